@@ -0,0 +1,178 @@
+import asyncio
+import html
+import logging
+from typing import Dict, List
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
+from aiogram.utils.exceptions import (BadRequest, BotBlocked, ChatNotFound, NetworkError,
+                                      RetryAfter, TelegramAPIError, UserDeactivated)
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Ограничение частоты запросов к Bot API (токен-бакет на цикле событий)
+
+    Telegram допускает около 30 сообщений в секунду на бота; при ответе
+    RetryAfter отправка приостанавливается целиком.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = None
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Ожидание разрешения на один запрос"""
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.updated is not None:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Остановка всех отправок на заданное время"""
+        self.paused_until = max(self.paused_until, asyncio.get_running_loop().time() + seconds)
+
+
+class AlertSender:
+    """Доставка уведомлений о новых объявлениях по сохранённым поискам
+
+    Очередь уведомлений хранится в базе (create_ad ставит их в той же
+    транзакции). Отправитель периодически забирает пачку, объединяет
+    уведомления одного пользователя в одно сообщение и рассылает их
+    несколькими задачами под общим ограничением частоты.
+    """
+
+    # Чат недоступен: уведомления удаляются без повторов
+    UNDELIVERABLE = (BotBlocked, ChatNotFound, UserDeactivated)
+    # Лимит Bot API на длину сообщения и длина названия в уведомлении
+    MAX_MESSAGE_LENGTH = 4096
+    MAX_TITLE_LENGTH = 100
+
+    def __init__(self, bot, db, interval: float = None, rate: float = None,
+                 workers: int = None, max_ads: int = None, batch_size: int = 500):
+        self.bot = bot
+        self.db = db
+        self.interval = config.ALERT_POLL_INTERVAL if interval is None else interval
+        self.limiter = RateLimiter(config.ALERT_RATE if rate is None else rate)
+        self.workers = workers or config.ALERT_WORKERS
+        self.max_ads = max_ads or config.ALERT_MAX_ADS
+        self.batch_size = batch_size
+        self.stopped = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        """Запуск фоновой задачи в текущем цикле событий"""
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while not self.stopped.is_set():
+            try:
+                fetched = await self.deliver_pending()
+            except Exception:
+                logger.exception('Ошибка рассылки уведомлений')
+                fetched = 0
+            if fetched < self.batch_size:
+                # Очередь разобрана - ждём новых уведомлений
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def deliver_pending(self) -> int:
+        """Отправка одной пачки уведомлений, возвращает число взятых из очереди"""
+        alerts = await self.db.get_pending_alerts(self.batch_size)
+        done = [alert['id'] for alert in alerts if not alert['is_active']]
+
+        by_user: Dict[int, List[Dict]] = {}
+        for alert in alerts:
+            if alert['is_active']:
+                by_user.setdefault(alert['telegram_id'], []).append(alert)
+
+        queue = asyncio.Queue()
+        for item in by_user.items():
+            queue.put_nowait(item)
+        await asyncio.gather(*[self.worker(queue, done)
+                               for _ in range(min(self.workers, len(by_user)))])
+
+        if done:
+            await self.db.delete_alerts(done)
+        return len(alerts)
+
+    async def worker(self, queue: asyncio.Queue, done: List[int]):
+        while not queue.empty():
+            telegram_id, alerts = queue.get_nowait()
+            if await self.send(telegram_id, alerts):
+                done.extend(alert['id'] for alert in alerts)
+
+    async def send(self, telegram_id: int, alerts: List[Dict]) -> bool:
+        """Одно сообщение со всеми новыми объявлениями пользователя
+
+        False - временная ошибка, уведомления остаются в очереди.
+        """
+        text = self.format_message(alerts)
+        keyboard = InlineKeyboardMarkup().add(InlineKeyboardButton(
+            text="📱 Открыть магазин",
+            web_app=WebAppInfo(url=f"{config.WEB_APP_URL}/index.html?user_id={telegram_id}")
+        ))
+        while True:
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(telegram_id, text, parse_mode='HTML',
+                                            reply_markup=keyboard)
+                return True
+            except RetryAfter as e:
+                logger.warning('Bot API просит подождать %s с', e.timeout)
+                self.limiter.pause(e.timeout)
+            except self.UNDELIVERABLE as e:
+                logger.info('Уведомление для %s не доставлено: %s', telegram_id, e)
+                return True
+            except BadRequest as e:
+                logger.error('Bot API отклонил уведомление для %s: %s', telegram_id, e)
+                return False
+            except (NetworkError, TelegramAPIError) as e:
+                logger.warning('Ошибка отправки уведомления для %s: %s', telegram_id, e)
+                return False
+
+    def format_message(self, alerts: List[Dict]) -> str:
+        """Текст уведомления не длиннее MAX_MESSAGE_LENGTH
+
+        Длинные названия обрезаются; объявления, не поместившиеся
+        в сообщение, попадают в строку «И ещё N».
+        """
+        text = "🔔 <b>Новые объявления по вашим поискам:</b>\n\n"
+        more = "\n<i>И ещё {}...</i>\n"
+        # Запас под строку «И ещё N»
+        limit = self.MAX_MESSAGE_LENGTH - len(more.format(len(alerts)))
+        shown = 0
+        for alert in alerts[:self.max_ads]:
+            title = alert['title']
+            if len(title) > self.MAX_TITLE_LENGTH:
+                title = title[:self.MAX_TITLE_LENGTH - 1] + '…'
+            line = f"• <b>{html.escape(title)}</b> - {alert['price']}₽\n"
+            if len(text) + len(line) > limit:
+                break
+            text += line
+            shown += 1
+        if len(alerts) > shown:
+            text += more.format(len(alerts) - shown)
+        return text
+
+    async def close(self):
+        """Остановка рассылки после текущей пачки"""
+        self.stopped.set()
+        if self.task:
+            await self.task
@@ -0,0 +1,40 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from database import Database
+import config
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database для обработчиков бота
+    
+    Каждый публичный метод Database доступен как корутина с той же сигнатурой
+    и выполняется в отдельном пуле потоков, не блокируя цикл событий.
+    """
+    
+    def __init__(self, db: Database, max_workers: int = None):
+        self.db = db
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or config.DB_EXECUTOR_WORKERS,
+            thread_name_prefix='db'
+        )
+    
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if name.startswith('_') or not callable(method):
+            return method
+        
+        @functools.wraps(method)
+        async def run(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(method, *args, **kwargs)
+            )
+        
+        # Кэшируем обёртку, чтобы не создавать её на каждый вызов
+        setattr(self, name, run)
+        return run
+    
+    def close(self):
+        """Ожидание запущенных запросов и остановка пула потоков"""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,239 @@
+import asyncio
+import hmac
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+import config
+
+logger = logging.getLogger(__name__)
+
+# Заголовки, которые передаются в WSGI без префикса HTTP_
+WSGI_PLAIN_HEADERS = {'CONTENT_TYPE', 'CONTENT_LENGTH'}
+
+# Ответы больше этого размера отдаются по мере чтения, а не целиком
+STREAM_THRESHOLD = 64 * 1024
+
+
+class RequestBody:
+    """Синхронное чтение тела запроса aiohttp из рабочего потока
+
+    Данные читаются из сокета по мере запроса приложением, поэтому большие
+    загрузки не собираются в памяти целиком.
+    """
+
+    def __init__(self, content, loop: asyncio.AbstractEventLoop):
+        self.content = content
+        self.loop = loop
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return self.call(self.content.read())
+        return self.call(self.content.read(size))
+
+    def readline(self, size: int = -1) -> bytes:
+        return self.call(self.content.readline())
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+class WSGIBridge:
+    """Обслуживание WSGI-приложения (Flask) из цикла событий aiohttp
+
+    Соединения, keep-alive и отдача ответа остаются в цикле событий,
+    а синхронные обработчики выполняются в ограниченном пуле потоков.
+    """
+
+    def __init__(self, wsgi_app, workers: int):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='http')
+
+    def build_environ(self, request: web.Request, body: RequestBody) -> dict:
+        """WSGI-окружение по запросу aiohttp"""
+        host, port = (request.host.split(':', 1) + [str(config.WEB_SERVER_PORT)])[:2]
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            # PATH_INFO по PEP 3333 - байты UTF-8, прочитанные как latin-1
+            'PATH_INFO': request.path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': request.rel_url.raw_query_string,
+            'SERVER_NAME': host,
+            'SERVER_PORT': port,
+            'SERVER_PROTOCOL': f'HTTP/{request.version.major}.{request.version.minor}',
+            'REMOTE_ADDR': request.remote or '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': request.scheme,
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.input_terminated': True,
+        }
+
+        for name, value in request.headers.items():
+            key = name.upper().replace('-', '_')
+            if key not in WSGI_PLAIN_HEADERS:
+                key = 'HTTP_' + key
+            if key in environ:
+                separator = '; ' if key == 'HTTP_COOKIE' else ','
+                value = environ[key] + separator + value
+            environ[key] = value
+        return environ
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        """Выполнение запроса WSGI-приложением и потоковая отдача ответа"""
+        loop = asyncio.get_running_loop()
+        environ = self.build_environ(request, RequestBody(request.content, loop))
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = headers
+            return lambda data: None
+
+        def run():
+            body = self.wsgi_app(environ, start_response)
+            iterator = iter(body)
+            # Небольшие ответы (JSON) забираем целиком за один переход в поток,
+            # большие (файлы) дочитываем по кускам уже во время отдачи
+            chunks, size = [], 0
+            for chunk in iterator:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= STREAM_THRESHOLD:
+                    return chunks, body, iterator
+            if hasattr(body, 'close'):
+                body.close()
+            return chunks, None, None
+
+        chunks, body, iterator = await loop.run_in_executor(self.executor, run)
+
+        status_code, reason = started['status'].split(' ', 1)
+        if iterator is None:
+            response = web.Response(status=int(status_code), reason=reason,
+                                    body=b''.join(chunks))
+            for name, value in started['headers']:
+                if name.lower() != 'content-length':
+                    response.headers.add(name, value)
+            return response
+
+        response = web.StreamResponse(status=int(status_code), reason=reason)
+        for name, value in started['headers']:
+            response.headers.add(name, value)
+        await response.prepare(request)
+        try:
+            for chunk in chunks:
+                await response.write(chunk)
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+                if chunk is None:
+                    break
+                await response.write(chunk)
+        finally:
+            if hasattr(body, 'close'):
+                await loop.run_in_executor(self.executor, body.close)
+
+        await response.write_eof()
+        return response
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class WebhookHandler:
+    """Приём обновлений Telegram через вебхук
+
+    Обновления обрабатываются параллельно, но не более max_in_flight
+    одновременно: при заполнении ответ Telegram задерживается, и он
+    сам снижает темп доставки.
+    """
+
+    def __init__(self, dispatcher, secret_token: str = None, max_in_flight: int = 100):
+        self.dispatcher = dispatcher
+        self.secret_token = secret_token
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.tasks = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Проверка секретного токена и постановка обновления в обработку"""
+        from aiogram import types
+
+        if self.secret_token:
+            received = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(received, self.secret_token):
+                return web.Response(status=401)
+
+        try:
+            update = types.Update(**await request.json())
+        except (ValueError, TypeError):
+            # Не JSON или JSON не объект обновления ([1, 2], строка)
+            return web.Response(status=400)
+
+        await self.slots.acquire()
+        task = asyncio.create_task(self.process(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.Response(text='ok')
+
+    async def process(self, update):
+        """Обработка одного обновления диспетчером бота"""
+        from aiogram import Bot, Dispatcher
+
+        try:
+            Dispatcher.set_current(self.dispatcher)
+            Bot.set_current(self.dispatcher.bot)
+            await self.dispatcher.process_update(update)
+        except Exception:
+            logger.exception('Ошибка обработки обновления %s', update.update_id)
+        finally:
+            self.slots.release()
+
+    async def close(self):
+        """Ожидание обновлений, которые ещё обрабатываются"""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+def create_app(wsgi_app=None, workers: int = None,
+               webhook: WebhookHandler = None) -> web.Application:
+    """Приложение aiohttp, обслуживающее все маршруты Flask-приложения и вебхук бота"""
+    if wsgi_app is None:
+        from web_app import app as flask_app
+        wsgi_app = flask_app.wsgi_app
+
+    bridge = WSGIBridge(wsgi_app, workers or config.WEB_WORKERS)
+    app = web.Application()
+    app['wsgi_bridge'] = bridge
+    if webhook:
+        app.router.add_post(config.WEBHOOK_PATH, webhook.handle)
+    app.router.add_route('*', '/{tail:.*}', bridge.handle)
+
+    async def on_cleanup(app):
+        if webhook:
+            await webhook.close()
+        bridge.close()
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+async def start_web_server(app: web.Application = None) -> web.AppRunner:
+    """Запуск HTTP-сервера в текущем цикле событий"""
+    runner = web.AppRunner(app or create_app(),
+                           keepalive_timeout=config.WEB_KEEPALIVE_TIMEOUT,
+                           access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEB_SERVER_HOST, config.WEB_SERVER_PORT)
+    await site.start()
+    logger.info('HTTP-сервер запущен на %s:%s', config.WEB_SERVER_HOST, config.WEB_SERVER_PORT)
+    return runner
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), host=config.WEB_SERVER_HOST, port=config.WEB_SERVER_PORT,
+                keepalive_timeout=config.WEB_KEEPALIVE_TIMEOUT)
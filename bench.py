@@ -0,0 +1,368 @@
+"""Бенчмарки методов Database и HTTP-эндпоинтов
+
+Запуск и сохранение результатов:
+    python bench.py run --sizes 1000 10000 --output bench.json
+Сравнение с сохранённым базовым прогоном (код выхода 1 при регрессиях):
+    python bench.py compare baseline.json bench.json --threshold 0.2
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+import config
+
+# Словарь для синтетических объявлений
+TITLE_WORDS = {
+    'расходники': ['Испаритель', 'Картридж', 'Атомайзер', 'Койл', 'Вата', 'Сетка'],
+    'жидкость': ['Жидкость', 'Солевая жидкость', 'Жижа', 'Никобустер', 'Ароматизатор'],
+    'одноразки': ['Одноразка', 'Одноразовая электронка', 'Пуфф', 'Затяжки'],
+    'подсистемы': ['Под-система', 'Мод', 'Аккумулятор', 'Боксмод', 'Зарядка'],
+    'другое': ['Чехол', 'Шнурок', 'Кейс', 'Дрип-тип', 'Стекло']
+}
+FLAVORS = ['манго', 'арбуз', 'клубника', 'ментол', 'табак', 'черника', 'ёлка', 'кола', 'виноград']
+DESCRIPTION_WORDS = ['новый', 'оригинал', 'запечатан', 'почти', 'без', 'торга', 'доставка',
+                     'самовывоз', 'гарантия', 'вкус', 'крепость', 'мл', 'затяжек', 'цвет',
+                     'чёрный', 'синий', 'обмен', 'срочно', 'недорого', 'комплект']
+LOCATIONS = ['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', None]
+
+
+def generate_dataset(db, users: int, ads: int, favorites: int, seed: int = 42) -> Dict:
+    """Заполнение базы синтетическими пользователями, объявлениями и избранным"""
+    rng = random.Random(seed)
+    categories = list(config.CATEGORIES)
+    user_ids = [db.register_user(100000 + i, f'user{i}', f'Имя{i}', None) for i in range(users)]
+
+    started = datetime(2024, 1, 1)
+    rows = []
+    for i in range(ads):
+        category = rng.choice(categories)
+        title = f'{rng.choice(TITLE_WORDS[category])} {rng.choice(FLAVORS)} {rng.randint(1, 99)}'
+        description = ' '.join(rng.choice(DESCRIPTION_WORDS + FLAVORS)
+                               for _ in range(rng.randint(5, 40)))
+        photos = json.dumps([f'https://example.com/photos/{i}_{n}.jpg'
+                             for n in range(rng.randint(0, 5))])
+        created_at = started + timedelta(seconds=i * 37 + rng.randint(0, 30))
+        rows.append((rng.choice(user_ids), title, description, rng.randint(100, 15000),
+                     category, photos, rng.choice(LOCATIONS),
+                     created_at.strftime('%Y-%m-%d %H:%M:%S'), rng.randint(0, 5000)))
+
+    # Массовая вставка напрямую: триггеры поддерживают индексы и счётчики
+    with db.write_transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO ads
+            (user_id, title, description, price, category, photos, location, created_at, views)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        cursor.execute('SELECT id FROM ads')
+        ad_ids = [row['id'] for row in cursor.fetchall()]
+        pairs = {(rng.choice(user_ids), rng.choice(ad_ids)) for _ in range(favorites)}
+        cursor.executemany('INSERT INTO favorites (user_id, ad_id) VALUES (?, ?)', sorted(pairs))
+
+    return {'user_ids': user_ids, 'ad_ids': ad_ids, 'telegram_ids': [100000 + i for i in range(users)],
+            'categories': categories, 'words': ['жидк', 'манго', 'испаритель', 'ёлка', 'оригинал']}
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(suite: str, name: str, size: int, concurrency: int,
+              samples: List[float], elapsed: float) -> Dict:
+    """Сводка по замерам в миллисекундах"""
+    return {
+        'suite': suite,
+        'name': name,
+        'size': size,
+        'concurrency': concurrency,
+        'count': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 4),
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 4),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 4),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 4),
+        'ops_per_sec': round(len(samples) / elapsed, 1) if elapsed else None
+    }
+
+
+def measure(call: Callable[[int], object], iterations: int, concurrency: int = 1):
+    """Замер задержки каждого вызова call(i) в concurrency потоках"""
+    samples = []
+    lock = threading.Lock()
+
+    def worker(indices):
+        local = []
+        for i in indices:
+            started = time.perf_counter()
+            call(i)
+            local.append(time.perf_counter() - started)
+        with lock:
+            samples.extend(local)
+
+    # Разогрев кэшей SQLite и интерпретатора
+    for i in range(min(10, iterations)):
+        call(i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, [range(n, iterations, concurrency) for n in range(concurrency)]))
+    return samples, time.perf_counter() - started
+
+
+def database_cases(db, data: Dict, rng: random.Random) -> Dict[str, Callable[[int], object]]:
+    """Сценарии для методов Database, включая все комбинации фильтров get_ads"""
+    from database import encode_cursor, SORT_ORDERS
+
+    ad_ids, user_ids = data['ad_ids'], data['user_ids']
+    # Курсор из середины ленты - аналог глубокой прокрутки
+    deep_offset = len(ad_ids) // 2
+    middle = db.get_ads(limit=1, offset=deep_offset)
+    deep_cursor = encode_cursor(middle[0]) if middle else None
+
+    cases = {}
+    for use_category, use_user, use_search, paging in itertools.product(
+            (False, True), (False, True), (False, True), ('first', 'offset', 'cursor')):
+        if paging == 'cursor' and use_search:
+            continue  # поиск упорядочен по релевантности и листается через offset
+        label = ','.join(name for name, used in (('category', use_category), ('user', use_user),
+                                                  ('search', use_search)) if used) or 'all'
+
+        def call(i, use_category=use_category, use_user=use_user,
+                 use_search=use_search, paging=paging):
+            return db.get_ads(
+                category=data['categories'][i % len(data['categories'])] if use_category else None,
+                user_id=user_ids[i % len(user_ids)] if use_user else None,
+                search_query=data['words'][i % len(data['words'])] if use_search else None,
+                limit=20,
+                offset=deep_offset if paging == 'offset' else 0,
+                cursor=deep_cursor if paging == 'cursor' else None
+            )
+        cases[f'get_ads[{label};{paging}]'] = call
+
+    # Остальные порядки ленты: глубокая страница по курсору с фильтром цены
+    for sort, (key, _) in SORT_ORDERS.items():
+        middle = db.get_ads(limit=1, offset=deep_offset, sort=sort)
+        sort_cursor = encode_cursor(middle[0], key) if middle else None
+        cases[f'get_ads[sort={sort};cursor]'] = \
+            lambda i, sort=sort, sort_cursor=sort_cursor: db.get_ads(
+                limit=20, sort=sort, cursor=sort_cursor, price_max=1000)
+
+    cases['get_ad_by_id'] = lambda i: db.get_ad_by_id(rng.choice(ad_ids))
+    cases['toggle_favorite'] = lambda i: db.toggle_favorite(rng.choice(user_ids), rng.choice(ad_ids))
+    cases['get_user_stats'] = lambda i: db.get_user_stats(rng.choice(user_ids))
+    cases['get_user_favorites'] = lambda i: db.get_user_favorites(rng.choice(user_ids))
+    cases['get_user_by_telegram_id'] = \
+        lambda i: db.get_user_by_telegram_id(rng.choice(data['telegram_ids']))
+    return cases
+
+
+def http_cases(data: Dict, rng: random.Random) -> Dict[str, Callable]:
+    """Сценарии для всех маршрутов /api/*: функция получает тестовый клиент и номер вызова
+
+    Каждый GET получает уникальный параметр nocache, поэтому замеряется
+    обработчик и запросы к базе, а не кэш ответов; сам кэш замеряется
+    отдельными сценариями с пометкой (cached).
+    """
+    from database import SORT_ORDERS
+
+    telegram_ids, ad_ids = data['telegram_ids'], data['ad_ids']
+    categories = data['categories']
+    sorts = list(SORT_ORDERS)
+    # Сквозной счётчик: значения не повторяются между уровнями параллельности
+    requests = itertools.count()
+
+    def get(client, url):
+        separator = '&' if '?' in url else '?'
+        return client.get(f'{url}{separator}nocache={next(requests)}')
+
+    def some_ids(count=20):
+        return ','.join(str(ad_id) for ad_id in rng.sample(ad_ids, min(count, len(ad_ids))))
+
+    return {
+        'GET /api/ads': lambda client, i: get(client, '/api/ads?limit=20'),
+        'GET /api/ads (cached)': lambda client, i: client.get('/api/ads?limit=20'),
+        'GET /api/ads?category': lambda client, i: get(
+            client, f'/api/ads?limit=20&category={categories[i % len(categories)]}'),
+        'GET /api/ads?search': lambda client, i: get(
+            client, f'/api/ads?limit=20&search={data["words"][i % len(data["words"])]}'),
+        'GET /api/ads?cursor': lambda client, i: get(client, '/api/ads?limit=20&cursor='),
+        'GET /api/ads?sort': lambda client, i: get(
+            client, f'/api/ads?limit=20&cursor=&sort={sorts[i % len(sorts)]}&price_max=1000'),
+        'GET /api/ad/<id>': lambda client, i: get(client, f'/api/ad/{rng.choice(ad_ids)}'),
+        'GET /api/ads_by_ids': lambda client, i: get(client, f'/api/ads_by_ids?ids={some_ids()}'),
+        'GET /api/user/<id>': lambda client, i: get(client, f'/api/user/{rng.choice(telegram_ids)}'),
+        'GET /api/categories': lambda client, i: get(client, '/api/categories'),
+        'GET /api/categories (cached)': lambda client, i: client.get('/api/categories'),
+        'GET /api/bootstrap': lambda client, i: get(
+            client, f'/api/bootstrap?user_id={rng.choice(telegram_ids)}'),
+        'GET /api/stats/<id>': lambda client, i: get(client, f'/api/stats/{rng.choice(telegram_ids)}'),
+        'GET /api/user_favorites/<id>': lambda client, i: get(
+            client, f'/api/user_favorites/{rng.choice(telegram_ids)}'),
+        'GET /api/favorite_states/<id>': lambda client, i: get(
+            client, f'/api/favorite_states/{rng.choice(telegram_ids)}?ids={some_ids()}'),
+        'GET /api/saved_searches/<id>': lambda client, i: get(
+            client, f'/api/saved_searches/{rng.choice(telegram_ids)}'),
+        'POST /api/toggle_favorite': lambda client, i: client.post('/api/toggle_favorite', json={
+            'user_id': rng.choice(telegram_ids), 'ad_id': rng.choice(ad_ids)}),
+        'POST /api/toggle_favorites': lambda client, i: client.post('/api/toggle_favorites', json={
+            'user_id': rng.choice(telegram_ids), 'ad_ids': rng.sample(ad_ids, min(10, len(ad_ids)))}),
+        'POST /api/save_search': lambda client, i: client.post('/api/save_search', json={
+            'user_id': rng.choice(telegram_ids), 'query': rng.choice(data['words']),
+            'price_max': rng.randint(500, 5000)}),
+        'POST /api/create_ad': lambda client, i: client.post('/api/create_ad', json={
+            'user_id': rng.choice(telegram_ids), 'title': f'Жидкость {rng.choice(FLAVORS)}',
+            'description': 'бенчмарк', 'price': rng.randint(100, 5000),
+            'category': rng.choice(categories)}),
+        'POST /api/delete_saved_search': lambda client, i: client.post(
+            '/api/delete_saved_search', json={'user_id': rng.choice(telegram_ids),
+                                              'search_id': rng.randint(1, i + 1)}),
+        'POST /api/delete_ad': lambda client, i: client.post('/api/delete_ad', json={
+            'user_id': rng.choice(telegram_ids), 'ad_id': rng.choice(ad_ids)}),
+    }
+
+
+def run_benchmarks(sizes: List[int], iterations: int, concurrency_levels: List[int],
+                   seed: int, suites: List[str]) -> Dict:
+    """Прогон всех сценариев на базах каждого размера"""
+    results = []
+    workdir = tempfile.mkdtemp(prefix='vape_bench_')
+    # web_app создаёт базу при импорте: направляем её во временный каталог
+    config.DB_PATH = os.path.join(workdir, 'import.db')
+    config.MEDIA_ROOT = os.path.join(workdir, 'media')
+    # Лимит сохранённых поисков не должен превращать сценарий в замер ошибки 400
+    config.MAX_SAVED_SEARCHES = 10 ** 9
+
+    from database import Database
+    import web_app
+
+    try:
+        for size in sizes:
+            results.extend(run_dataset(Database(os.path.join(workdir, f'bench_{size}.db')),
+                                       web_app, size, iterations, concurrency_levels,
+                                       seed, suites))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'iterations': iterations,
+            'seed': seed
+        },
+        'results': results
+    }
+
+
+def run_dataset(db, web_app, size: int, iterations: int, concurrency_levels: List[int],
+                seed: int, suites: List[str]) -> List[Dict]:
+    """Прогон сценариев на одной синтетической базе заданного размера"""
+    results = []
+    data = generate_dataset(db, users=max(10, size // 20), ads=size,
+                            favorites=size * 2, seed=seed)
+    rng = random.Random(seed)
+
+    if 'db' in suites:
+        for name, call in database_cases(db, data, rng).items():
+            samples, elapsed = measure(call, iterations)
+            results.append(summarize('db', name, size, 1, samples, elapsed))
+            print(f'db   {size:>7} {name:<45} p95={results[-1]["p95_ms"]:.3f}ms',
+                  file=sys.stderr)
+
+    if 'http' in suites:
+        web_app.db = db
+        web_app.response_cache.clear()
+        for name, request in http_cases(data, rng).items():
+            for concurrency in concurrency_levels:
+                clients = {}
+
+                def call(i, request=request):
+                    client = clients.setdefault(threading.get_ident(),
+                                                web_app.app.test_client())
+                    request(client, i)
+
+                samples, elapsed = measure(call, iterations, concurrency)
+                results.append(summarize('http', name, size, concurrency, samples, elapsed))
+                print(f'http {size:>7} {name:<33} c={concurrency:<3} '
+                      f'p95={results[-1]["p95_ms"]:.3f}ms', file=sys.stderr)
+
+    db.close()
+    return results
+
+
+def compare(baseline: Dict, current: Dict, threshold: float, metric: str = 'p95_ms') -> List[Dict]:
+    """Сравнение прогонов: сценарии, где metric вырос больше чем на threshold"""
+    def key(result):
+        return result['suite'], result['name'], result['size'], result['concurrency']
+
+    previous = {key(result): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        before = previous.get(key(result))
+        if not before or not before[metric]:
+            continue
+        change = result[metric] / before[metric] - 1
+        if change > threshold:
+            regressions.append({
+                'suite': result['suite'], 'name': result['name'], 'size': result['size'],
+                'concurrency': result['concurrency'], 'metric': metric,
+                'baseline': before[metric], 'current': result[metric],
+                'change': round(change, 3)
+            })
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарки базы данных и API')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='запустить бенчмарки')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                            help='число объявлений в синтетических базах')
+    run_parser.add_argument('--iterations', type=int, default=200)
+    run_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    run_parser.add_argument('--suites', nargs='+', choices=['db', 'http'], default=['db', 'http'])
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+
+    compare_parser = commands.add_parser('compare', help='сравнить с базовым прогоном')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help='допустимый относительный рост (0.2 = +20%%)')
+    compare_parser.add_argument('--metric', default='p95_ms',
+                                choices=['p50_ms', 'p95_ms', 'p99_ms', 'mean_ms'])
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run_benchmarks(args.sizes, args.iterations, args.concurrency,
+                                args.seed, args.suites)
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(output)
+        else:
+            print(output)
+    else:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold, args.metric)
+        print(json.dumps({'regressions': regressions}, ensure_ascii=False, indent=2))
+        sys.exit(1 if regressions else 0)
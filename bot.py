@@ -1,22 +1,64 @@
+import asyncio
 import logging
+import time
 from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from aiogram.utils import executor
 import config
-from database import Database
+import metrics
+from database import encode_cursor
+from async_database import AsyncDatabase
+from alerts import AlertSender
+from maintenance import MaintenanceJob
+import web_app
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Инициализация бота
-bot = Bot(token=config.BOT_TOKEN)
+if config.BOT_API_URL:
+    bot = Bot(token=config.BOT_TOKEN, server=TelegramAPIServer.from_base(config.BOT_API_URL))
+else:
+    bot = Bot(token=config.BOT_TOKEN)
 dp = Dispatcher(bot)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время работы обработчиков команд и колбэков для /metrics"""
+    
+    async def on_process_message(self, message: types.Message, data: dict):
+        data['metrics_handler'] = current_handler.get().__name__
+        data['metrics_started'] = time.perf_counter()
+    
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        data['metrics_handler'] = current_handler.get().__name__
+        data['metrics_started'] = time.perf_counter()
+    
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self.observe('message', data)
+    
+    async def on_post_process_callback_query(self, callback_query: types.CallbackQuery,
+                                             results, data: dict):
+        self.observe('callback_query', data)
+    
+    def observe(self, update_type: str, data: dict):
+        # Обновления, для которых не нашлось обработчика, не учитываются
+        if 'metrics_started' in data:
+            metrics.BOT_HANDLER_DURATION.observe(time.perf_counter() - data['metrics_started'],
+                                                 update_type, data['metrics_handler'])
+
+
 dp.middleware.setup(LoggingMiddleware())
+dp.middleware.setup(MetricsMiddleware())
 
-# Инициализация базы данных
-db = Database()
+# База общая с Mini App: один писатель и один кэш пользователей на процесс,
+# обработчики бота работают с ней через пул потоков
+db = AsyncDatabase(web_app.db)
 
 @dp.message_handler(commands=['start'])
 async def cmd_start(message: types.Message):
@@ -27,7 +69,7 @@ async def cmd_start(message: types.Message):
     first_name = message.from_user.first_name
     last_name = message.from_user.last_name
     
-    db.register_user(user_id, username, first_name, last_name)
+    await db.register_user(user_id, username, first_name, last_name)
     
     # Создаем клавиатуру с кнопкой Mini App
     keyboard = InlineKeyboardMarkup(row_width=2)
@@ -70,57 +112,107 @@ async def cmd_start(message: types.Message):
                         parse_mode='Markdown', 
                         reply_markup=keyboard)
 
-@dp.callback_query_handler(lambda c: c.data == 'my_ads')
+# Объявлений на одной странице списка в боте
+PAGE_SIZE = 5
+# Поля, которые нужны для строки списка
+LIST_FIELDS = ['title', 'price', 'views']
+
+
+def page_keyboard(prefix: str, page: int, items: list, has_next: bool,
+                  cursor_key: str = 'created_at') -> InlineKeyboardMarkup:
+    """Кнопки «назад/вперёд» с курсорами крайних элементов страницы
+    
+    callback_data: '<prefix>:<p|n>:<номер страницы>:<курсор>' (до 64 байт).
+    """
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton(
+            "⬅️ Назад",
+            callback_data=f"{prefix}:p:{page - 1}:{encode_cursor(items[0], cursor_key)}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
+            "Вперёд ➡️",
+            callback_data=f"{prefix}:n:{page + 1}:{encode_cursor(items[-1], cursor_key)}"))
+    keyboard.add(*buttons)
+    return keyboard
+
+
+def parse_page(data: str) -> tuple:
+    """Направление, номер страницы и курсор из callback_data (первая страница - без курсора)"""
+    parts = data.split(':', 3)
+    if len(parts) != 4:
+        return None, 1, None
+    return parts[1], int(parts[2]), parts[3]
+
+
+async def show_page(callback_query: types.CallbackQuery, text: str, keyboard, first_page: bool):
+    """Первая страница - новым сообщением, остальные - правкой того же сообщения"""
+    if first_page:
+        await callback_query.message.answer(text, parse_mode='Markdown', reply_markup=keyboard)
+    else:
+        await callback_query.message.edit_text(text, parse_mode='Markdown', reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@dp.callback_query_handler(lambda c: c.data == 'my_ads' or c.data.startswith('my_ads:'))
 async def process_my_ads(callback_query: types.CallbackQuery):
-    """Показ объявлений пользователя"""
-    user = db.get_user_by_telegram_id(callback_query.from_user.id)
+    """Показ объявлений пользователя постранично"""
+    user = await db.get_user_by_telegram_id(callback_query.from_user.id)
     if not user:
         return
     
-    ads = db.get_ads(user_id=user['id'])
+    direction, page, cursor = parse_page(callback_query.data)
+    # Лишняя строка показывает, есть ли следующая страница
+    ads = await db.get_ads(user_id=user['id'], limit=PAGE_SIZE + 1, fields=LIST_FIELDS,
+                           cursor=cursor if direction == 'n' else None,
+                           before=cursor if direction == 'p' else None)
+    has_next = len(ads) > PAGE_SIZE if direction != 'p' else True
+    ads = ads[-PAGE_SIZE:] if direction == 'p' else ads[:PAGE_SIZE]
     
     if not ads:
         await callback_query.answer("У вас пока нет объявлений", show_alert=True)
         return
     
-    text = "📋 *Ваши объявления:*\n\n"
-    for ad in ads[:5]:  # Показываем первые 5
+    total = await db.count_user_ads(user['id'])
+    text = f"📋 *Ваши объявления* ({total}), страница {page}:\n\n"
+    for ad in ads:
         text += f"• *{ad['title']}* - {ad['price']}₽\n"
         text += f"  👁 {ad['views']} просмотров\n\n"
     
-    if len(ads) > 5:
-        text += f"*И ещё {len(ads) - 5} объявлений...*\n"
-    
     text += "\nЧтобы управлять объявлениями, откройте Mini App 📱"
     
-    await callback_query.message.answer(text, parse_mode='Markdown')
-    await callback_query.answer()
+    await show_page(callback_query, text, page_keyboard('my_ads', page, ads, has_next),
+                    first_page=direction is None)
 
-@dp.callback_query_handler(lambda c: c.data == 'favorites')
+@dp.callback_query_handler(lambda c: c.data == 'favorites' or c.data.startswith('favorites:'))
 async def process_favorites(callback_query: types.CallbackQuery):
-    """Показ избранного"""
-    user = db.get_user_by_telegram_id(callback_query.from_user.id)
+    """Показ избранного постранично"""
+    user = await db.get_user_by_telegram_id(callback_query.from_user.id)
     if not user:
         return
     
-    favorites = db.get_user_favorites(user['id'])
+    direction, page, cursor = parse_page(callback_query.data)
+    favorites = await db.get_user_favorites(user['id'], fields=LIST_FIELDS, limit=PAGE_SIZE + 1,
+                                            cursor=cursor if direction == 'n' else None,
+                                            before=cursor if direction == 'p' else None)
+    has_next = len(favorites) > PAGE_SIZE if direction != 'p' else True
+    favorites = favorites[-PAGE_SIZE:] if direction == 'p' else favorites[:PAGE_SIZE]
     
     if not favorites:
         await callback_query.answer("В избранном пока ничего нет", show_alert=True)
         return
     
-    text = "❤️ *Ваши избранные объявления:*\n\n"
-    for ad in favorites[:5]:  # Показываем первые 5
+    total = await db.count_user_favorites(user['id'])
+    text = f"❤️ *Ваши избранные объявления* ({total}), страница {page}:\n\n"
+    for ad in favorites:
         text += f"• *{ad['title']}* - {ad['price']}₽\n"
         text += f"  👁 {ad['views']} просмотров\n\n"
     
-    if len(favorites) > 5:
-        text += f"*И ещё {len(favorites) - 5} в избранном...*\n"
-    
     text += "\nЧтобы просмотреть все, откройте Mini App 📱"
     
-    await callback_query.message.answer(text, parse_mode='Markdown')
-    await callback_query.answer()
+    keyboard = page_keyboard('favorites', page, favorites, has_next, cursor_key='favorited_at')
+    await show_page(callback_query, text, keyboard, first_page=direction is None)
 
 @dp.callback_query_handler(lambda c: c.data == 'help')
 async def process_help(callback_query: types.CallbackQuery):
@@ -159,13 +251,56 @@ async def handle_text(message: types.Message):
         await message.answer("Используйте кнопки меню или команду /start")
 
 if __name__ == '__main__':
-    from web_app import run_web_server
-    import threading
+    web_runner = None
+    alert_sender = AlertSender(bot, db)
+    maintenance = MaintenanceJob(db)
+    use_webhook = config.BOT_MODE == 'webhook'
+    # Вебхук принимает тот же async-сервер, что обслуживает Mini App
+    use_async_server = use_webhook or config.WEB_SERVER_MODE == 'async'
     
-    # Запускаем веб-сервер в отдельном потоке
-    web_thread = threading.Thread(target=run_web_server)
-    web_thread.daemon = True
-    web_thread.start()
+    async def on_startup(dp):
+        global web_runner
+        if use_async_server:
+            # Mini App обслуживается из того же цикла событий, что и бот
+            from async_server import create_app, start_web_server, WebhookHandler
+            webhook = None
+            if use_webhook:
+                webhook = WebhookHandler(dp, config.WEBHOOK_SECRET or None,
+                                         config.WEBHOOK_MAX_IN_FLIGHT)
+            web_runner = await start_web_server(create_app(webhook=webhook))
+        
+        if use_webhook:
+            await bot.set_webhook(config.WEBHOOK_URL,
+                                  secret_token=config.WEBHOOK_SECRET or None,
+                                  max_connections=config.WEBHOOK_MAX_IN_FLIGHT,
+                                  drop_pending_updates=True)
+        
+        # Уведомления по сохранённым поискам рассылаются в фоне
+        alert_sender.start()
+        # Архивирование снятых объявлений и vacuum базы
+        maintenance.start()
+    
+    async def on_shutdown(dp):
+        await alert_sender.close()
+        await maintenance.close()
+        if web_runner:
+            await web_runner.cleanup()
+        db.close()
+        await bot.close()
+    
+    if not use_async_server:
+        from web_app import run_web_server
+        import threading
+        
+        # Запускаем веб-сервер в отдельном потоке
+        web_thread = threading.Thread(target=run_web_server)
+        web_thread.daemon = True
+        web_thread.start()
     
     logger.info("Бот запущен!")
-    executor.start_polling(dp, skip_updates=True)
+    if use_webhook:
+        executor.start(dp, asyncio.Event().wait(),
+                       on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, skip_updates=True,
+                               on_startup=on_startup, on_shutdown=on_shutdown)
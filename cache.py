@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограничением размера и временем жизни записей"""
+    
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Значение по ключу или default, если его нет или оно устарело"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self.remove(key)
+            self.misses += 1
+            return default
+    
+    def set(self, key: Hashable, value: Any):
+        """Сохранение значения с вытеснением самых давно использованных записей"""
+        with self.lock:
+            self.store(key, value)
+    
+    def delete(self, key: Hashable):
+        """Удаление записи, если она есть"""
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+    
+    def clear(self):
+        """Удаление всех записей"""
+        with self.lock:
+            for key in list(self.entries):
+                self.remove(key)
+    
+    def store(self, key: Hashable, value: Any):
+        """Запись значения (вызывается под блокировкой)"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.remove(next(iter(self.entries)))
+    
+    def remove(self, key: Hashable):
+        """Удаление записи (вызывается под блокировкой)"""
+        del self.entries[key]
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class ResponseCache(LRUCache):
+    """Кэш готовых ответов API с точечной инвалидацией по тегам
+    
+    Каждый ответ помечается тегами (например, 'ads' или 'stats:<telegram_id>'),
+    и операции записи сбрасывают только ответы с затронутыми тегами.
+    """
+    
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        super().__init__(maxsize, ttl)
+        self.tag_keys: Dict[str, Set[Hashable]] = {}
+        self.key_tags: Dict[Hashable, Iterable[str]] = {}
+        # Номер поколения растёт при каждой инвалидации
+        self.generation = 0
+    
+    def set(self, key: Hashable, value: Any, tags: Iterable[str] = (),
+            generation: Optional[int] = None):
+        """Сохранение ответа; пропускается, если после generation была инвалидация"""
+        tags = tuple(tags)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                # Ответ собран до изменения данных и мог устареть
+                return
+            if key in self.entries:
+                self.remove(key)
+            for tag in tags:
+                self.tag_keys.setdefault(tag, set()).add(key)
+            self.key_tags[key] = tags
+            self.store(key, value)
+    
+    def invalidate(self, *tags: str):
+        """Сброс всех ответов, помеченных любым из тегов"""
+        with self.lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self.tag_keys.get(tag, ())):
+                    if key in self.entries:
+                        self.remove(key)
+    
+    def remove(self, key: Hashable):
+        super().remove(key)
+        for tag in self.key_tags.pop(key, ()):
+            keys = self.tag_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_keys[tag]
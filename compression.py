@@ -0,0 +1,41 @@
+import gzip
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # без brotli ответы сжимаются только gzip
+    brotli = None
+
+# Сжимаются только текстовые ответы: фото и превью уже сжаты
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/javascript',
+    'text/plain'
+}
+
+# Быстрые уровни: ответы API сжимаются на каждый промах кэша
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+# Статика сжимается один раз при запуске - можно не экономить
+GZIP_BEST_LEVEL = 9
+BROTLI_BEST_QUALITY = 11
+
+
+def supported_encodings() -> list:
+    """Доступные кодировки в порядке предпочтения"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate_encoding(accept_encodings) -> Optional[str]:
+    """Лучшая кодировка по Accept-Encoding (werkzeug Accept) или None"""
+    return accept_encodings.best_match(supported_encodings())
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """Сжатие тела ответа выбранной кодировкой (best - максимальное сжатие)"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_BEST_QUALITY if best else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_BEST_LEVEL if best else GZIP_LEVEL, mtime=0)
@@ -5,8 +5,75 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 WEB_APP_URL = os.getenv('WEB_APP_URL', 'https://your-domain.com')  # Для вебхуков
+
+# Получение обновлений: 'polling' или 'webhook' (вебхук обслуживает async-сервер)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', WEB_APP_URL + WEBHOOK_PATH)
+# Секрет, который Telegram присылает в X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Сколько обновлений обрабатывается одновременно
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv('WEBHOOK_MAX_IN_FLIGHT', '100'))
+# Адрес своего (или тестового) сервера Bot API, пусто - api.telegram.org
+BOT_API_URL = os.getenv('BOT_API_URL', '')
 WEB_SERVER_HOST = '0.0.0.0'
 WEB_SERVER_PORT = 8080
+# Режим веб-сервера: 'thread' - Flask в отдельном потоке,
+# 'async' - aiohttp в цикле событий бота
+WEB_SERVER_MODE = os.getenv('WEB_SERVER_MODE', 'thread')
+# Потоки для обработчиков API в режиме async и таймаут keep-alive (сек)
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '16'))
+WEB_KEEPALIVE_TIMEOUT = float(os.getenv('WEB_KEEPALIVE_TIMEOUT', '75'))
+
+# Файл базы данных SQLite
+DB_PATH = os.getenv('DB_PATH', 'vape_market.db')
+
+# SQLite: размер пула соединений для чтения и настройки страничного кэша
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '16384'))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+# Журнал медленных запросов: порог в мс (0 - выключен) и файл JSON Lines
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '0'))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', 'slow_queries.jsonl')
+# Потоки, в которых бот выполняет запросы к базе, не блокируя цикл событий
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '8'))
+
+# Кэш пользователей по telegram_id: число записей и время жизни (сек)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))
+
+# Отложенная запись просмотров: интервал сброса (сек) и размер пачки
+VIEW_FLUSH_INTERVAL = float(os.getenv('VIEW_FLUSH_INTERVAL', '5'))
+VIEW_FLUSH_THRESHOLD = int(os.getenv('VIEW_FLUSH_THRESHOLD', '500'))
+
+# Кэш ответов API: число записей и время жизни (сек)
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '2048'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '30'))
+# Ответы меньше этого размера (байт) не сжимаются
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '512'))
+
+# Обслуживание базы: перенос снятых объявлений в архив и incremental vacuum
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', '600'))  # 0 - выключено
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_MAX_BATCHES = int(os.getenv('ARCHIVE_MAX_BATCHES', '20'))
+# Срок жизни объявления в днях, после него оно уходит в архив (0 - бессрочно)
+AD_TTL_DAYS = float(os.getenv('AD_TTL_DAYS', '0'))
+# Не больше стольких страниц возвращается файлу за один проход
+VACUUM_PAGES = int(os.getenv('VACUUM_PAGES', '2000'))
+
+# Уведомления по сохранённым поискам: опрос очереди (сек) и скорость отправки
+ALERT_POLL_INTERVAL = float(os.getenv('ALERT_POLL_INTERVAL', '2'))
+# Лимит Bot API - около 30 сообщений в секунду, оставляем запас
+ALERT_RATE = float(os.getenv('ALERT_RATE', '25'))
+ALERT_WORKERS = int(os.getenv('ALERT_WORKERS', '4'))
+ALERT_MAX_ADS = int(os.getenv('ALERT_MAX_ADS', '10'))
+MAX_SAVED_SEARCHES = int(os.getenv('MAX_SAVED_SEARCHES', '20'))
+
+# Загрузка фото: каталог хранилища, лимит размера запроса и потоки для превью
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', 'media')
+MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', '10'))
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', '2'))
 
 # Категории для вейп магазина
 CATEGORIES = {
@@ -1,109 +1,1147 @@
 import sqlite3
 import json
+import logging
+import re
+import base64
+import atexit
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Optional
+from cache import LRUCache
+import metrics
+from metrics import registry, track_queries, observe_query
+import config
+
+# Полнотекстовый индекс: unicode61 приводит кириллицу к нижнему регистру,
+# а ё/е нормализуем сами в триггерах и в запросе
+FTS_NORMALIZE_SQL = "replace(replace(coalesce({0}, ''), 'ё', 'е'), 'Ё', 'Е')"
+
+
+def search_terms(text: str) -> List[str]:
+    """Слова текста в той же нормализации, что и в поиске (регистр, ё/е)"""
+    return re.findall(r'\w+', (text or '').lower().replace('ё', 'е'))
+
+
+def build_fts_query(search_query: str) -> Optional[str]:
+    """Преобразование поисковой строки в запрос FTS5 (префиксный поиск по всем словам)"""
+    words = search_terms(search_query)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# Длиннее этого слова сохранённых поисков не сравниваются (как префиксы)
+MAX_TERM_LENGTH = 32
+
+
+def saved_search_keys(terms: List[str], category: Optional[str]) -> List[str]:
+    """Ключи сохранённого поиска в инвертированном индексе
+    
+    Поиск без слов индексируется по категории (или общим ключом), чтобы
+    и его находил тот же запрос по ключам объявления.
+    """
+    if terms:
+        return sorted({term[:MAX_TERM_LENGTH] for term in terms})
+    return [f'#category:{category}' if category else '#all']
+
+
+def ad_match_keys(title: str, description: str, category: str) -> List[str]:
+    """Ключи объявления: все префиксы его слов и служебные ключи поисков без слов
+    
+    Слово сохранённого поиска ищется как префикс (как в поиске по ленте),
+    поэтому число ключей зависит только от текста объявления.
+    """
+    keys = {'#all', f'#category:{category}'}
+    for word in set(search_terms(f'{title} {description}')):
+        word = word[:MAX_TERM_LENGTH]
+        keys.update(word[:length] for length in range(1, len(word) + 1))
+    return sorted(keys)
+
+
+# Поля объявления, доступные для выборки (?fields= в API), и их выражения SQL
+AD_FIELDS = {
+    'id': 'ads.id',
+    'user_id': 'ads.user_id',
+    'title': 'ads.title',
+    'description': 'ads.description',
+    'price': 'ads.price',
+    'category': 'ads.category',
+    'photos': 'ads.photos',
+    'location': 'ads.location',
+    'contact_preference': 'ads.contact_preference',
+    'is_active': 'ads.is_active',
+    'created_at': 'ads.created_at',
+    'views': 'ads.views',
+    'favorites_count': 'ads.favorites_count',
+    'telegram_id': 'users.telegram_id',
+    'username': 'users.username',
+    'first_name': 'users.first_name'
+}
+USER_FIELDS = {'telegram_id', 'username', 'first_name'}
+# Поля, без которых не работают пагинация и учёт просмотров
+REQUIRED_FIELDS = ('id', 'created_at')
+
+
+def select_ad_fields(fields: Optional[List[str]] = None) -> tuple:
+    """Список колонок SELECT и признак, нужен ли JOIN с users
+    
+    fields=None - все поля объявления; неизвестное поле - ValueError.
+    """
+    if fields is None:
+        return 'ads.*, users.telegram_id, users.username, users.first_name', True
+    unknown = [name for name in fields if name not in AD_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field: {', '.join(unknown)}")
+    names = list(REQUIRED_FIELDS) + [name for name in fields if name not in REQUIRED_FIELDS]
+    names = list(dict.fromkeys(names))
+    columns = ', '.join(f'{AD_FIELDS[name]} AS {name}' for name in names)
+    return columns, bool(USER_FIELDS.intersection(names))
+
+
+def encode_cursor(ad: Dict, key: str = 'created_at') -> str:
+    """Непрозрачный курсор пагинации по (ключ сортировки, id) объявления
+    
+    key - поле сортировки: время публикации, время добавления в избранное,
+    цена или счётчик (числа сохраняются числами, чтобы сравнение в SQL
+    шло по тем же правилам, что и в индексе).
+    """
+    value = ad[key]
+    if not isinstance(value, (int, float)):
+        value = str(value)
+    raw = json.dumps([value, ad['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Optional[tuple]:
+    """Разбор курсора пагинации, None для некорректного значения"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, ad_id = json.loads(raw)
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            return None
+        return value, int(ad_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    """Курсор из запроса: None для пустого, ValueError для некорректного"""
+    if not cursor:
+        return None
+    position = decode_cursor(cursor)
+    if position is None:
+        raise ValueError('Invalid cursor')
+    return position
+
+
+# Индексы ленты, которые раньше строились по всем объявлениям (is_active, ...)
+FULL_FEED_INDEXES = ('idx_ads_feed', 'idx_ads_price_feed', 'idx_ads_views_feed',
+                     'idx_ads_favorites_feed')
+
+# Фильтры-равенства, для которых у каждого порядка ленты есть свой индекс
+FEED_PREFIXES = {'category': 'category', 'location': 'location', 'user': 'user_id'}
+
+# Колонки объявления, которые переносятся в архив
+ARCHIVE_AD_COLUMNS = ('id, user_id, title, description, price, category, photos, location, '
+                      'contact_preference, is_active, created_at, views, favorites_count')
+
+
+# Порядки ленты (?sort= в API): поле объявления и направление.
+# Для каждого есть частичный индекс (ключ, id) - общий, по категории, городу и продавцу,
+# поэтому любая страница читается диапазоном индекса без сортировки.
+SORT_ORDERS = {
+    'newest': ('created_at', 'DESC'),
+    'price_asc': ('price', 'ASC'),
+    'price_desc': ('price', 'DESC'),
+    'views': ('views', 'DESC'),
+    'favorites': ('favorites_count', 'DESC'),
+}
+
+
+def sort_order(sort: Optional[str]) -> tuple:
+    """Поле и направление сортировки ленты, ValueError для неизвестного порядка"""
+    if sort is None:
+        return SORT_ORDERS['newest']
+    if sort not in SORT_ORDERS:
+        raise ValueError(f"Unknown sort: {sort}")
+    return SORT_ORDERS[sort]
+
+
+class ViewCounter:
+    """Накопитель просмотров: приращения копятся в памяти и пишутся одной транзакцией"""
+    
+    def __init__(self, flush_callback, interval: float, threshold: int):
+        self.flush_callback = flush_callback
+        self.interval = interval
+        self.threshold = threshold
+        self.pending_views: Dict[int, int] = {}
+        self.lock = threading.Lock()
+        self.flush_requested = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        
+        if interval > 0:
+            self.thread = threading.Thread(target=self.run, name='view-counter', daemon=True)
+            self.thread.start()
+    
+    def add(self, ad_id: int) -> int:
+        """Учёт просмотра, возвращает число ещё не записанных просмотров объявления"""
+        with self.lock:
+            count = self.pending_views.get(ad_id, 0) + 1
+            self.pending_views[ad_id] = count
+            total = len(self.pending_views)
+        
+        if total >= self.threshold:
+            if self.thread:
+                self.flush_requested.set()
+            else:
+                self.flush()
+        return count
+    
+    def pending(self, ad_id: int) -> int:
+        """Число ещё не записанных просмотров объявления"""
+        return self.pending_views.get(ad_id, 0)
+    
+    def flush(self):
+        """Запись накопленных приращений в базу"""
+        with self.lock:
+            deltas, self.pending_views = self.pending_views, {}
+        if not deltas:
+            return
+        
+        try:
+            self.flush_callback(deltas)
+        except Exception:
+            # Возвращаем приращения, чтобы не потерять их до следующей попытки
+            with self.lock:
+                for ad_id, count in deltas.items():
+                    self.pending_views[ad_id] = self.pending_views.get(ad_id, 0) + count
+            raise
+    
+    def run(self):
+        """Фоновый сброс по таймеру или по достижении порога"""
+        while not self.stopped.is_set():
+            self.flush_requested.wait(self.interval)
+            self.flush_requested.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logging.getLogger(__name__).exception('Не удалось записать просмотры')
+    
+    def close(self):
+        """Остановка фонового потока и финальный сброс"""
+        self.stopped.set()
+        self.flush_requested.set()
+        if self.thread:
+            self.thread.join()
+        self.flush()
+
+
+def normalize_sql(sql: str) -> str:
+    """Форма запроса: литералы заменены на ?, списки IN (?, ?, ...) свёрнуты, пробелы сжаты"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = ' '.join(sql.split())
+    return re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(...)', sql)
+
+
+class SlowQueryLog:
+    """Журнал медленных запросов в формате JSON Lines с планом выполнения
+    
+    Запись: форма запроса, параметры, время, метод Database и
+    вывод EXPLAIN QUERY PLAN, по которому видно полные сканирования.
+    """
+    
+    # План строится только для запросов к данным
+    EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+    
+    def __init__(self, path: str, threshold_ms: float):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.lock = threading.Lock()
+    
+    def record(self, cursor: sqlite3.Cursor, sql: str, parameters, elapsed: float):
+        """Запись запроса в журнал (вызывается, только если он медленнее порога)"""
+        entry = {
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'method': getattr(metrics.current, 'method', None),
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'sql': normalize_sql(sql),
+            'params': [self.format_param(value) for value in parameters]
+                      if isinstance(parameters, (list, tuple)) else parameters,
+            'plan': self.explain(cursor.connection, sql, parameters)
+        }
+        logging.getLogger(__name__).warning('Медленный запрос %.1f мс в %s: %s',
+                                            entry['elapsed_ms'], entry['method'], entry['sql'])
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    
+    def explain(self, conn: sqlite3.Connection, sql: str, parameters) -> List[str]:
+        if not sql.lstrip().upper().startswith(self.EXPLAINABLE):
+            return []
+        try:
+            # Обычный курсор: план не должен попадать в метрики и в журнал
+            cursor = conn.cursor(sqlite3.Cursor)
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)
+            return [row[-1] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            return [f'EXPLAIN failed: {e}']
+    
+    @staticmethod
+    def format_param(value):
+        if isinstance(value, str) and len(value) > 200:
+            return value[:200] + '...'
+        if isinstance(value, bytes):
+            return f'<{len(value)} bytes>'
+        return value
+
+
+def slow_query_report(path: str, top: int = 20) -> List[Dict]:
+    """Самые дорогие формы запросов из журнала медленных запросов
+    
+    Группы отсортированы по суммарному времени; full_scan отмечает планы
+    со сканированием таблицы без индекса.
+    """
+    shapes: Dict[str, Dict] = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            shape = shapes.setdefault(entry['sql'], {
+                'sql': entry['sql'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'methods': set(), 'plan': entry['plan'], 'example_params': entry['params']
+            })
+            shape['count'] += 1
+            shape['total_ms'] += entry['elapsed_ms']
+            if entry['elapsed_ms'] > shape['max_ms']:
+                # План и параметры самого медленного выполнения
+                shape['max_ms'] = entry['elapsed_ms']
+                shape['plan'] = entry['plan']
+                shape['example_params'] = entry['params']
+            if entry['method']:
+                shape['methods'].add(entry['method'])
+    
+    report = sorted(shapes.values(), key=lambda shape: shape['total_ms'], reverse=True)[:top]
+    for shape in report:
+        shape['total_ms'] = round(shape['total_ms'], 3)
+        shape['avg_ms'] = round(shape['total_ms'] / shape['count'], 3)
+        shape['methods'] = sorted(shape['methods'])
+        shape['full_scan'] = any(re.match(r'SCAN \w+$', step.strip()) for step in shape['plan'])
+    return report
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, который учитывает число и время запросов в метриках
+    
+    Запросы дольше порога попадают в журнал медленных запросов соединения.
+    """
+    
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.observe(sql, parameters, time.perf_counter() - started)
+    
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # Для плана достаточно первого набора параметров
+            self.observe(sql, seq_of_parameters[0] if seq_of_parameters else (),
+                         time.perf_counter() - started)
+    
+    def observe(self, sql, parameters, elapsed: float):
+        observe_query(elapsed)
+        slow_log = self.connection.slow_log
+        if slow_log is not None and elapsed >= slow_log.threshold:
+            slow_log.record(self, sql, parameters, elapsed)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, курсоры которого (в том числе для conn.execute) - TimedCursor"""
+    
+    slow_log: Optional[SlowQueryLog] = None
+    
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+
+class ConnectionPool:
+    """Ограниченный пул соединений для чтения, общий для всех потоков"""
+    
+    def __init__(self, connect, size: int):
+        self.connect = connect
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+    
+    @contextmanager
+    def connection(self):
+        """Выдача свободного соединения (ждёт, если заняты все)"""
+        with self.slots:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+            try:
+                yield conn
+            finally:
+                self.idle.put(conn)
+    
+    def close(self):
+        """Закрытие всех простаивающих соединений"""
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
 
 class Database:
-    def __init__(self, db_name='vape_market.db'):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
+    def __init__(self, db_name: str = None,
+                 view_flush_interval: float = None, view_flush_threshold: int = None,
+                 pool_size: int = None, slow_query_ms: float = None):
+        db_name = db_name or config.DB_PATH
+        # Для базы в памяти все соединения пула должны видеть одни и те же данные
+        if db_name == ':memory:':
+            self.db_name = f'file:vape_market_{id(self)}?mode=memory&cache=shared'
+            self.db_uri = True
+        else:
+            self.db_name = db_name
+            self.db_uri = False
+        
+        # Журнал медленных запросов включается порогом больше нуля
+        slow_query_ms = config.SLOW_QUERY_MS if slow_query_ms is None else slow_query_ms
+        self.slow_log = SlowQueryLog(config.SLOW_QUERY_LOG, slow_query_ms) \
+            if slow_query_ms > 0 else None
+        
+        # Единственное соединение для записи: писатель в SQLite всегда один
+        self.writer = self.connect()
+        self.write_lock = threading.RLock()
+        self.pool = ConnectionPool(self.connect,
+                                   config.DB_POOL_SIZE if pool_size is None else pool_size)
+        # Соединение, закреплённое за потоком на время read_snapshot()
+        self.pinned = threading.local()
+        # Горячий кэш telegram_id -> пользователь (TTL ограничивает расхождение
+        # с другими процессами, которые пишут в ту же базу)
+        self.users = LRUCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+        registry.register_cache('users', self.users)
+        # Место от архивированных объявлений возвращается файлу по расписанию
+        self.enable_incremental_vacuum()
         self.create_tables()
+        
+        self.views = ViewCounter(
+            self.write_views,
+            config.VIEW_FLUSH_INTERVAL if view_flush_interval is None else view_flush_interval,
+            config.VIEW_FLUSH_THRESHOLD if view_flush_threshold is None else view_flush_threshold
+        )
+        atexit.register(self.close)
+    
+    def connect(self) -> sqlite3.Connection:
+        """Новое соединение с настройками WAL и кэша страниц"""
+        # Запросы через курсоры соединения попадают в метрики /metrics
+        conn = sqlite3.connect(self.db_name, uri=self.db_uri, check_same_thread=False,
+                               isolation_level=None,
+                               timeout=config.DB_BUSY_TIMEOUT_MS / 1000,
+                               factory=TimedConnection)
+        conn.row_factory = sqlite3.Row
+        conn.slow_log = self.slow_log
+        # Настройка соединения не относится к методу, который его открыл
+        setup = conn.cursor(sqlite3.Cursor)
+        # WAL: читатели не блокируются писателем и наоборот
+        setup.execute('PRAGMA journal_mode = WAL')
+        setup.execute('PRAGMA synchronous = NORMAL')
+        setup.execute(f'PRAGMA cache_size = {-config.DB_CACHE_SIZE_KB}')
+        setup.execute(f'PRAGMA mmap_size = {config.DB_MMAP_SIZE}')
+        setup.execute(f'PRAGMA busy_timeout = {config.DB_BUSY_TIMEOUT_MS}')
+        if self.db_uri:
+            # Общий кэш базы в памяти: без этого читатели упираются в блокировки таблиц
+            setup.execute('PRAGMA read_uncommitted = 1')
+        setup.close()
+        return conn
+    
+    @contextmanager
+    def read_cursor(self):
+        """Курсор соединения из пула для запросов на чтение"""
+        conn = getattr(self.pinned, 'connection', None)
+        if conn is not None:
+            # Внутри read_snapshot() все чтения идут через одно соединение
+            yield conn.cursor()
+            return
+        with self.pool.connection() as conn:
+            yield conn.cursor()
+    
+    @contextmanager
+    def read_snapshot(self):
+        """Согласованный снимок базы для нескольких методов чтения подряд
+        
+        Соединение из пула закрепляется за потоком и держит открытую
+        транзакцию чтения: в WAL все запросы видят одно и то же состояние.
+        """
+        if getattr(self.pinned, 'connection', None) is not None:
+            yield
+            return
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')
+            self.pinned.connection = conn
+            try:
+                yield
+            finally:
+                self.pinned.connection = None
+                conn.execute('COMMIT')
+    
+    @contextmanager
+    def write_transaction(self):
+        """Курсор писателя внутри транзакции; записи выполняются строго по очереди"""
+        with self.write_lock:
+            cursor = self.writer.cursor()
+            if self.writer.in_transaction:
+                # Вложенный вызов продолжает уже открытую транзакцию
+                yield cursor
+                return
+            
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+            except BaseException:
+                self.writer.rollback()
+                raise
+            self.writer.commit()
+    
+    def close(self):
+        """Сброс отложенных просмотров и закрытие соединений"""
+        atexit.unregister(self.close)
+        self.views.close()
+        self.pool.close()
+        self.writer.close()
+    
+    @track_queries
+    def write_views(self, deltas: Dict[int, int]):
+        """Пакетная запись приращений просмотров одной транзакцией"""
+        with self.write_transaction() as cursor:
+            cursor.executemany('UPDATE ads SET views = views + ? WHERE id = ?',
+                               [(count, ad_id) for ad_id, count in deltas.items()])
     
+    @track_queries
     def create_tables(self):
-        cursor = self.conn.cursor()
+        with self.write_transaction() as cursor:
+            # Таблица пользователей
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    telegram_id INTEGER UNIQUE NOT NULL,
+                    username TEXT,
+                    first_name TEXT,
+                    last_name TEXT,
+                    phone TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Таблица объявлений
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ads (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    description TEXT,
+                    price REAL NOT NULL,
+                    category TEXT NOT NULL,
+                    photos TEXT,  -- JSON массив с URL фото
+                    location TEXT,
+                    contact_preference TEXT DEFAULT 'telegram',
+                    is_active BOOLEAN DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    views INTEGER DEFAULT 0,
+                    favorites_count INTEGER DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            
+            # Миграция старых баз: счётчик избранного хранится прямо в объявлении
+            if self.add_column_if_missing(cursor, 'ads', 'favorites_count', 'INTEGER DEFAULT 0'):
+                self.rebuild_favorites_count()
+            
+            # Таблица избранного
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS favorites (
+                    user_id INTEGER NOT NULL,
+                    ad_id INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, ad_id),
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (ad_id) REFERENCES ads (id) ON DELETE CASCADE
+                )
+            ''')
+            
+            # Полные индексы ленты из прошлых версий заменяются частичными:
+            # снятые объявления не занимают места в горячих индексах
+            cursor.execute('PRAGMA index_list(ads)')
+            for row in cursor.fetchall():
+                if row['name'] in FULL_FEED_INDEXES and not row['partial']:
+                    cursor.execute(f"DROP INDEX {row['name']}")
+            
+            # Индексы для ленты: одинаковая стоимость любой страницы при любом фильтре
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_ads_feed
+                ON ads (created_at DESC, id DESC) WHERE is_active = 1
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_ads_category_feed
+                ON ads (category, created_at DESC, id DESC) WHERE is_active = 1
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_ads_user_feed
+                ON ads (user_id, created_at DESC, id DESC) WHERE is_active = 1
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_ads_location_feed
+                ON ads (location, created_at DESC, id DESC) WHERE is_active = 1
+            ''')
+            # Остальные порядки ленты (SORT_ORDERS): по убыванию индекс читается с конца
+            for name, column in (('price', 'price'), ('views', 'views'),
+                                 ('favorites', 'favorites_count')):
+                cursor.execute(f'''
+                    CREATE INDEX IF NOT EXISTS idx_ads_{name}_feed
+                    ON ads ({column}, id) WHERE is_active = 1
+                ''')
+                for prefix in ('category', 'location', 'user'):
+                    cursor.execute(f'''
+                        CREATE INDEX IF NOT EXISTS idx_ads_{prefix}_{name}_feed
+                        ON ads ({FEED_PREFIXES[prefix]}, {column}, id) WHERE is_active = 1
+                    ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_ads_user_id ON ads (user_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_favorites_ad_id ON favorites (ad_id)')
+            
+            # Счётчик избранного поддерживается триггерами при каждом изменении
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS favorites_count_insert AFTER INSERT ON favorites
+                BEGIN
+                    UPDATE ads SET favorites_count = favorites_count + 1 WHERE id = new.ad_id;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS favorites_count_delete AFTER DELETE ON favorites
+                BEGIN
+                    UPDATE ads SET favorites_count = favorites_count - 1 WHERE id = old.ad_id;
+                END
+            ''')
+            
+            # Избранное пользователя постранично, от новых к старым
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_favorites_user_feed
+                ON favorites (user_id, created_at DESC, ad_id DESC)
+            ''')
+            
+            self.create_search_index(cursor)
+            self.create_seller_stats(cursor)
+            self.create_favorite_counts(cursor)
+            self.create_saved_searches(cursor)
+            self.create_archive(cursor)
+    
+    def add_column_if_missing(self, cursor, table: str, column: str, definition: str) -> bool:
+        """Добавление колонки в существующую таблицу, True если колонка была добавлена"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        if any(row['name'] == column for row in cursor.fetchall()):
+            return False
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+    
+    @track_queries
+    def rebuild_favorites_count(self) -> int:
+        """Пересчёт favorites_count для всех объявлений, возвращает число исправленных"""
+        with self.write_transaction() as cursor:
+            cursor.execute('''
+                UPDATE ads SET favorites_count = (
+                    SELECT COUNT(*) FROM favorites WHERE favorites.ad_id = ads.id
+                )
+                WHERE favorites_count IS NOT (
+                    SELECT COUNT(*) FROM favorites WHERE favorites.ad_id = ads.id
+                )
+            ''')
+            return cursor.rowcount
+    
+    def create_seller_stats(self, cursor):
+        """Статистика продавцов, которую триггеры обновляют при каждом изменении объявлений"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'seller_stats'")
+        exists = cursor.fetchone() is not None
         
-        # Таблица пользователей
+        # total_favorites - число активных объявлений, которые хоть раз добавили в избранное
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE NOT NULL,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                phone TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            CREATE TABLE IF NOT EXISTS seller_stats (
+                user_id INTEGER PRIMARY KEY,
+                total_ads INTEGER NOT NULL DEFAULT 0,
+                total_views INTEGER NOT NULL DEFAULT 0,
+                total_favorites INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS seller_stats_insert AFTER INSERT ON ads
+            WHEN new.is_active = 1
+            BEGIN
+                INSERT INTO seller_stats (user_id, total_ads, total_views, total_favorites)
+                VALUES (new.user_id, 1, new.views, new.favorites_count > 0)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    total_ads = total_ads + 1,
+                    total_views = total_views + excluded.total_views,
+                    total_favorites = total_favorites + excluded.total_favorites;
+            END
+        ''')
+        # Вклад объявления в статистику: старый вычитается, новый прибавляется
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS seller_stats_update
+            AFTER UPDATE OF is_active, views, favorites_count ON ads
+            BEGIN
+                INSERT OR IGNORE INTO seller_stats (user_id) VALUES (new.user_id);
+                UPDATE seller_stats SET
+                    total_ads = total_ads + (new.is_active = 1) - (old.is_active = 1),
+                    total_views = total_views
+                        + (CASE WHEN new.is_active = 1 THEN new.views ELSE 0 END)
+                        - (CASE WHEN old.is_active = 1 THEN old.views ELSE 0 END),
+                    total_favorites = total_favorites
+                        + (new.is_active = 1 AND new.favorites_count > 0)
+                        - (old.is_active = 1 AND old.favorites_count > 0)
+                WHERE user_id = new.user_id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS seller_stats_delete AFTER DELETE ON ads
+            WHEN old.is_active = 1
+            BEGIN
+                UPDATE seller_stats SET
+                    total_ads = total_ads - 1,
+                    total_views = total_views - old.views,
+                    total_favorites = total_favorites - (old.favorites_count > 0)
+                WHERE user_id = old.user_id;
+            END
+        ''')
+        
+        if not exists:
+            self.rebuild_seller_stats()
+    
+    @track_queries
+    def rebuild_seller_stats(self) -> int:
+        """Пересчёт статистики всех продавцов с нуля, возвращает число продавцов"""
+        with self.write_transaction() as cursor:
+            cursor.execute('DELETE FROM seller_stats')
+            cursor.execute('''
+                INSERT INTO seller_stats (user_id, total_ads, total_views, total_favorites)
+                SELECT user_id, COUNT(*), SUM(views), SUM(favorites_count > 0)
+                FROM ads
+                WHERE is_active = 1
+                GROUP BY user_id
+            ''')
+            return cursor.rowcount
+    
+    @track_queries
+    def check_seller_stats(self) -> List[Dict]:
+        """Сверка сохранённой статистики с пересчитанной, возвращает расхождения"""
+        with self.read_cursor() as cursor:
+            cursor.execute('''
+                WITH actual AS (
+                    SELECT user_id,
+                           COUNT(*) AS total_ads,
+                           SUM(views) AS total_views,
+                           SUM(favorites_count > 0) AS total_favorites
+                    FROM ads
+                    WHERE is_active = 1
+                    GROUP BY user_id
+                ),
+                sellers AS (
+                    SELECT user_id FROM actual
+                    UNION
+                    SELECT user_id FROM seller_stats
+                )
+                SELECT sellers.user_id,
+                       coalesce(stored.total_ads, 0) AS stored_ads,
+                       coalesce(actual.total_ads, 0) AS actual_ads,
+                       coalesce(stored.total_views, 0) AS stored_views,
+                       coalesce(actual.total_views, 0) AS actual_views,
+                       coalesce(stored.total_favorites, 0) AS stored_favorites,
+                       coalesce(actual.total_favorites, 0) AS actual_favorites
+                FROM sellers
+                LEFT JOIN seller_stats AS stored ON stored.user_id = sellers.user_id
+                LEFT JOIN actual ON actual.user_id = sellers.user_id
+                WHERE stored_ads != actual_ads
+                   OR stored_views != actual_views
+                   OR stored_favorites != actual_favorites
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def create_favorite_counts(self, cursor):
+        """Число активных объявлений в избранном у каждого пользователя (ведут триггеры)"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'favorite_counts'")
+        exists = cursor.fetchone() is not None
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS favorite_counts (
+                user_id INTEGER PRIMARY KEY,
+                total INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES users (id)
             )
         ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS favorite_counts_insert AFTER INSERT ON favorites
+            WHEN (SELECT is_active FROM ads WHERE id = new.ad_id) = 1
+            BEGIN
+                INSERT INTO favorite_counts (user_id, total) VALUES (new.user_id, 1)
+                ON CONFLICT (user_id) DO UPDATE SET total = total + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS favorite_counts_delete AFTER DELETE ON favorites
+            WHEN (SELECT is_active FROM ads WHERE id = old.ad_id) = 1
+            BEGIN
+                UPDATE favorite_counts SET total = total - 1 WHERE user_id = old.user_id;
+            END
+        ''')
+        # Снятое или возвращённое объявление меняет счётчик у всех, кто его добавил
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS favorite_counts_ad_update AFTER UPDATE OF is_active ON ads
+            WHEN (old.is_active = 1) != (new.is_active = 1)
+            BEGIN
+                INSERT OR IGNORE INTO favorite_counts (user_id)
+                SELECT user_id FROM favorites WHERE ad_id = new.id;
+                UPDATE favorite_counts SET total = total + (new.is_active = 1) - (old.is_active = 1)
+                WHERE user_id IN (SELECT user_id FROM favorites WHERE ad_id = new.id);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS favorite_counts_ad_delete AFTER DELETE ON ads
+            WHEN old.is_active = 1
+            BEGIN
+                UPDATE favorite_counts SET total = total - 1
+                WHERE user_id IN (SELECT user_id FROM favorites WHERE ad_id = old.id);
+            END
+        ''')
         
-        # Таблица объявлений
+        if not exists:
+            self.rebuild_favorite_counts()
+    
+    @track_queries
+    def rebuild_favorite_counts(self) -> int:
+        """Пересчёт счётчиков избранного с нуля, возвращает число пользователей"""
+        with self.write_transaction() as cursor:
+            cursor.execute('DELETE FROM favorite_counts')
+            cursor.execute('''
+                INSERT INTO favorite_counts (user_id, total)
+                SELECT favorites.user_id, COUNT(*)
+                FROM favorites
+                JOIN ads ON ads.id = favorites.ad_id
+                WHERE ads.is_active = 1
+                GROUP BY favorites.user_id
+            ''')
+            return cursor.rowcount
+    
+    def create_saved_searches(self, cursor):
+        """Сохранённые поиски, их инвертированный индекс и очередь уведомлений"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS saved_searches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                query TEXT,
+                category TEXT,
+                price_min REAL,
+                price_max REAL,
+                term_count INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ads (
+            CREATE INDEX IF NOT EXISTS idx_saved_searches_user_id ON saved_searches (user_id)
+        ''')
+        # Ключ -> поиски: поиск подходит, если у объявления есть все его ключи
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS saved_search_terms (
+                term TEXT NOT NULL,
+                search_id INTEGER NOT NULL,
+                PRIMARY KEY (term, search_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS saved_search_terms_delete AFTER DELETE ON saved_searches
+            BEGIN
+                DELETE FROM saved_search_terms WHERE search_id = old.id;
+            END
+        ''')
+        # Неотправленные уведомления; одно объявление - одно уведомление пользователю
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS search_alerts (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
+                ad_id INTEGER NOT NULL,
+                search_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (user_id, ad_id)
+            )
+        ''')
+
+    def create_archive(self, cursor):
+        """Архив снятых и истёкших объявлений и их избранного (холодные данные)"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ads_archive (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
                 title TEXT NOT NULL,
                 description TEXT,
                 price REAL NOT NULL,
                 category TEXT NOT NULL,
-                photos TEXT,  # JSON массив с URL фото
+                photos TEXT,
                 location TEXT,
-                contact_preference TEXT DEFAULT 'telegram',
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                views INTEGER DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (id)
+                contact_preference TEXT,
+                is_active BOOLEAN,
+                created_at TIMESTAMP,
+                views INTEGER,
+                favorites_count INTEGER,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        
-        # Таблица избранного
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS favorites (
-                user_id INTEGER NOT NULL,
+            CREATE TABLE IF NOT EXISTS favorites_archive (
                 ad_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, ad_id),
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (ad_id) REFERENCES ads (id) ON DELETE CASCADE
+                user_id INTEGER NOT NULL,
+                created_at TIMESTAMP,
+                PRIMARY KEY (ad_id, user_id)
+            ) WITHOUT ROWID
+        ''')
+        # Очередь на архивирование: снятые объявления без полного сканирования ads
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ads_inactive ON ads (id) WHERE is_active = 0
+        ''')
+
+    def create_search_index(self, cursor):
+        """Полнотекстовый индекс FTS5 по названию и описанию активных объявлений"""
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS ads_fts USING fts5(
+                title,
+                description,
+                tokenize = 'unicode61 remove_diacritics 2'
             )
         ''')
         
-        self.conn.commit()
+        # Синхронизация индекса с таблицей объявлений
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS ads_fts_insert AFTER INSERT ON ads
+            WHEN new.is_active = 1
+            BEGIN
+                INSERT INTO ads_fts (rowid, title, description)
+                VALUES (new.id, {FTS_NORMALIZE_SQL.format('new.title')},
+                        {FTS_NORMALIZE_SQL.format('new.description')});
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS ads_fts_deactivate AFTER UPDATE OF is_active ON ads
+            WHEN old.is_active = 1 AND new.is_active = 0
+            BEGIN
+                DELETE FROM ads_fts WHERE rowid = old.id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS ads_fts_delete AFTER DELETE ON ads
+            BEGIN
+                DELETE FROM ads_fts WHERE rowid = old.id;
+            END
+        ''')
+        
+        # Заполняем индекс для уже существующей базы
+        cursor.execute('SELECT 1 FROM ads_fts LIMIT 1')
+        if not cursor.fetchone():
+            cursor.execute(f'''
+                INSERT INTO ads_fts (rowid, title, description)
+                SELECT id, {FTS_NORMALIZE_SQL.format('title')},
+                       {FTS_NORMALIZE_SQL.format('description')}
+                FROM ads WHERE is_active = 1
+            ''')
     
+    @track_queries
     def register_user(self, telegram_id: int, username: str = None, 
                      first_name: str = None, last_name: str = None) -> int:
         """Регистрация/обновление пользователя"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO users 
-            (telegram_id, username, first_name, last_name) 
-            VALUES (?, ?, ?, ?)
-        ''', (telegram_id, username, first_name, last_name))
-        self.conn.commit()
-        return cursor.lastrowid
+        cached = self.users.get(telegram_id)
+        if cached and (cached['username'], cached['first_name'], cached['last_name']) == \
+                (username, first_name, last_name):
+            # Профиль не изменился - запись не нужна
+            return cached['id']
+        
+        with self.write_transaction() as cursor:
+            # Обновление на месте: id пользователя не меняется, а при
+            # неизменном профиле строка не перезаписывается
+            cursor.execute('''
+                INSERT INTO users 
+                (telegram_id, username, first_name, last_name) 
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (telegram_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name
+                WHERE users.username IS NOT excluded.username
+                   OR users.first_name IS NOT excluded.first_name
+                   OR users.last_name IS NOT excluded.last_name
+            ''', (telegram_id, username, first_name, last_name))
+            cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
+            user = dict(cursor.fetchone())
+        
+        self.users.set(telegram_id, user)
+        return user['id']
     
+    @track_queries
     def create_ad(self, user_id: int, title: str, description: str, 
                  price: float, category: str, photos: List[str] = None,
                  location: str = None, contact_preference: str = 'telegram') -> int:
         """Создание нового объявления"""
-        cursor = self.conn.cursor()
         photos_json = json.dumps(photos) if photos else '[]'
         
+        with self.write_transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO ads 
+                (user_id, title, description, price, category, photos, location, contact_preference)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, title, description, price, category, photos_json, location, contact_preference))
+            ad_id = cursor.lastrowid
+            
+            # Уведомления подписчикам сохранённых поисков ставятся в очередь
+            # той же транзакцией: объявление и уведомления появляются вместе
+            self.queue_search_alerts(cursor, ad_id, user_id, title, description, price, category)
+            return ad_id
+    
+    def queue_search_alerts(self, cursor, ad_id: int, user_id: int, title: str,
+                            description: str, price: float, category: str):
+        """Поиск подходящих сохранённых поисков по инвертированному индексу"""
         cursor.execute('''
-            INSERT INTO ads 
-            (user_id, title, description, price, category, photos, location, contact_preference)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, title, description, price, category, photos_json, location, contact_preference))
+            INSERT OR IGNORE INTO search_alerts (user_id, ad_id, search_id)
+            SELECT saved_searches.user_id, ?, saved_searches.id
+            FROM (
+                SELECT search_id, COUNT(*) AS matched
+                FROM saved_search_terms
+                WHERE term IN (SELECT value FROM json_each(?))
+                GROUP BY search_id
+            ) AS hits
+            JOIN saved_searches ON saved_searches.id = hits.search_id
+            WHERE hits.matched = saved_searches.term_count
+              AND saved_searches.user_id != ?
+              AND (saved_searches.category IS NULL OR saved_searches.category = ?)
+              AND (saved_searches.price_min IS NULL OR saved_searches.price_min <= ?)
+              AND (saved_searches.price_max IS NULL OR saved_searches.price_max >= ?)
+            ORDER BY saved_searches.id
+        ''', (ad_id, json.dumps(ad_match_keys(title, description, category)),
+              user_id, category, price, price))
+    
+    @track_queries
+    def create_saved_search(self, user_id: int, query: str = None, category: str = None,
+                            price_min: float = None, price_max: float = None) -> int:
+        """Сохранение поиска для уведомлений о новых объявлениях"""
+        keys = saved_search_keys(search_terms(query), category)
+        with self.write_transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO saved_searches
+                (user_id, query, category, price_min, price_max, term_count)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, query, category, price_min, price_max, len(keys)))
+            search_id = cursor.lastrowid
+            cursor.executemany('INSERT INTO saved_search_terms (term, search_id) VALUES (?, ?)',
+                               [(key, search_id) for key in keys])
+            return search_id
+    
+    @track_queries
+    def get_saved_searches(self, user_id: int) -> List[Dict]:
+        """Сохранённые поиски пользователя"""
+        with self.read_cursor() as cursor:
+            cursor.execute('''
+                SELECT id, query, category, price_min, price_max, created_at
+                FROM saved_searches
+                WHERE user_id = ?
+                ORDER BY id DESC
+            ''', (user_id,))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    @track_queries
+    def delete_saved_search(self, user_id: int, search_id: int) -> bool:
+        """Удаление сохранённого поиска (и его ключей - триггером)"""
+        with self.write_transaction() as cursor:
+            cursor.execute('DELETE FROM saved_searches WHERE id = ? AND user_id = ?',
+                           (search_id, user_id))
+            return cursor.rowcount > 0
+    
+    @track_queries
+    def get_pending_alerts(self, limit: int = 500) -> List[Dict]:
+        """Неотправленные уведомления по порядку постановки в очередь
         
-        self.conn.commit()
-        return cursor.lastrowid
+        is_active = 0 - объявление уже снято, такое уведомление не отправляется.
+        """
+        with self.read_cursor() as cursor:
+            cursor.execute('''
+                SELECT search_alerts.id, search_alerts.ad_id,
+                       users.telegram_id, ads.title, ads.price,
+                       coalesce(ads.is_active, 0) AS is_active
+                FROM search_alerts
+                JOIN users ON users.id = search_alerts.user_id
+                LEFT JOIN ads ON ads.id = search_alerts.ad_id
+                ORDER BY search_alerts.id
+                LIMIT ?
+            ''', (limit,))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    @track_queries
+    def delete_alerts(self, alert_ids: List[int]):
+        """Удаление доставленных (или недоставляемых) уведомлений"""
+        with self.write_transaction() as cursor:
+            cursor.execute('DELETE FROM search_alerts WHERE id IN (SELECT value FROM json_each(?))',
+                           (json.dumps(alert_ids),))
     
+    @track_queries
     def get_ads(self, category: str = None, user_id: int = None, 
-               limit: int = 50, offset: int = 0, search_query: str = None) -> List[Dict]:
-        """Получение объявлений с фильтрами"""
-        cursor = self.conn.cursor()
-        
-        query = '''
-            SELECT ads.*, 
-                   users.telegram_id, 
-                   users.username, 
-                   users.first_name,
-                   COUNT(favorites.ad_id) as favorites_count
+               limit: int = 50, offset: int = 0, search_query: str = None,
+               cursor: str = None, fields: List[str] = None,
+               before: str = None, price_min: float = None, price_max: float = None,
+               location: str = None, sort: str = None) -> List[Dict]:
+        """Получение объявлений с фильтрами
+        
+        cursor - курсор из encode_cursor() по полю сортировки для постраничной
+        ленты без OFFSET (для поиска по релевантности используется offset);
+        before - курсор для предыдущей страницы: объявления перед ним;
+        fields - выбираемые поля из AD_FIELDS (id, created_at и поле
+        сортировки есть всегда); sort - порядок из SORT_ORDERS, по умолчанию
+        новые сначала, а для поиска - по релевантности.
+        При сортировке по просмотрам отдаются записанные в базу значения
+        (без ещё не сброшенных из памяти), чтобы курсор совпадал с индексом.
+        """
+        sort_key, direction = sort_order(sort)
+        if fields is not None and sort_key not in fields:
+            fields = list(fields) + [sort_key]
+        columns, join_users = select_ad_fields(fields)
+        query = f'''
+            SELECT {columns}
             FROM ads
-            LEFT JOIN users ON ads.user_id = users.id
-            LEFT JOIN favorites ON ads.id = favorites.ad_id
-            WHERE ads.is_active = 1
         '''
         params = []
         
+        fts_query = build_fts_query(search_query) if search_query else None
+        if search_query and not fts_query:
+            return []
+        
+        if fts_query:
+            # Кандидаты из полнотекстового индекса с рангом релевантности
+            query += '''
+            JOIN (SELECT rowid, rank
+                  FROM ads_fts WHERE ads_fts MATCH ?) AS search ON search.rowid = ads.id
+            '''
+            params.append(fts_query)
+        
+        if join_users:
+            query += ' LEFT JOIN users ON ads.user_id = users.id'
+        query += ' WHERE ads.is_active = 1'
+        
         if category:
             query += ' AND ads.category = ?'
             params.append(category)
@@ -112,142 +1150,403 @@ class Database:
             query += ' AND ads.user_id = ?'
             params.append(user_id)
         
-        if search_query:
-            query += ' AND (ads.title LIKE ? OR ads.description LIKE ?)'
-            params.extend([f'%{search_query}%', f'%{search_query}%'])
+        if location:
+            query += ' AND ads.location = ?'
+            params.append(location)
+        
+        # При сортировке не по цене унарный + не даёт планировщику взять
+        # индекс по цене: диапазон проверяется при чтении индекса порядка
+        price = 'ads.price' if sort_key == 'price' else '+ads.price'
+        if price_min is not None:
+            query += f' AND {price} >= ?'
+            params.append(price_min)
+        
+        if price_max is not None:
+            query += f' AND {price} <= ?'
+            params.append(price_max)
+        
+        # Ключ (поле, id) в одном направлении: страница - диапазон индекса
+        key = f'(ads.{sort_key}, ads.id)'
+        forward = '<' if direction == 'DESC' else '>'
+        backward = '>' if direction == 'DESC' else '<'
+        reverse = 'ASC' if direction == 'DESC' else 'DESC'
         
-        query += ' GROUP BY ads.id ORDER BY ads.created_at DESC LIMIT ? OFFSET ?'
+        position, previous = parse_cursor(cursor), parse_cursor(before)
+        if fts_query:
+            position = previous = None
+        if position:
+            query += f' AND {key} {forward} (?, ?)'
+            params.extend(position)
+            offset = 0
+        elif previous:
+            # Предыдущая страница: ближайшие в обратном порядке, затем разворот
+            query += f' AND {key} {backward} (?, ?)'
+            params.extend(previous)
+            offset = 0
+        
+        if fts_query and sort is None:
+            query += ' ORDER BY search.rank, ads.created_at DESC, ads.id DESC'
+        elif previous:
+            query += f' ORDER BY ads.{sort_key} {reverse}, ads.id {reverse}'
+        else:
+            query += f' ORDER BY ads.{sort_key} {direction}, ads.id {direction}'
+        query += ' LIMIT ? OFFSET ?'
         params.extend([limit, offset])
         
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+        with self.read_cursor() as db_cursor:
+            db_cursor.execute(query, params)
+            rows = db_cursor.fetchall()
         
-        ads = []
-        for row in rows:
-            ad = dict(row)
+        if previous:
+            rows.reverse()
+        return [self.row_to_ad(row, pending_views=sort_key != 'views') for row in rows]
+    
+    def row_to_ad(self, row: sqlite3.Row, pending_views: bool = True) -> Dict:
+        """Словарь объявления: фото разбираются и просмотры дополняются, только если выбраны"""
+        ad = dict(row)
+        if 'photos' in ad:
             ad['photos'] = json.loads(ad['photos']) if ad['photos'] else []
-            ads.append(ad)
-        
-        return ads
+        if 'views' in ad and pending_views:
+            ad['views'] += self.views.pending(ad['id'])
+        return ad
     
+    @track_queries
     def get_ad_by_id(self, ad_id: int) -> Optional[Dict]:
         """Получение объявления по ID"""
-        cursor = self.conn.cursor()
-        
-        cursor.execute('''
-            UPDATE ads SET views = views + 1 WHERE id = ?
-        ''', (ad_id,))
-        
-        cursor.execute('''
-            SELECT ads.*, 
-                   users.telegram_id, 
-                   users.username, 
-                   users.first_name
-            FROM ads
-            LEFT JOIN users ON ads.user_id = users.id
-            WHERE ads.id = ?
-        ''', (ad_id,))
+        ads = self.get_ads_by_ids([ad_id])
+        if not ads:
+            return None
+        ad = ads[0]
+        # Просмотр учитывается в памяти и записывается в базу пачкой;
+        # ранее накопленные уже добавлены в row_to_ad()
+        self.views.add(ad_id)
+        ad['views'] += 1
+        return ad
+    
+    @track_queries
+    def get_ads_by_ids(self, ad_ids: List[int], fields: List[str] = None) -> List[Dict]:
+        """Объявления по списку ID одним запросом, в порядке списка
         
-        row = cursor.fetchone()
-        if row:
-            ad = dict(row)
-            ad['photos'] = json.loads(ad['photos']) if ad['photos'] else []
-            self.conn.commit()
-            return ad
+        Просмотры не учитываются (это не открытие объявления); fields - как в get_ads.
+        """
+        columns, join_users = select_ad_fields(fields)
+        users_join = 'LEFT JOIN users ON ads.user_id = users.id' if join_users else ''
+        with self.read_cursor() as cursor:
+            # Список передаётся одним параметром JSON: форма запроса не зависит от длины
+            cursor.execute(f'''
+                SELECT {columns}
+                FROM ads
+                {users_join}
+                WHERE ads.id IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(ad_ids),))
+            rows = cursor.fetchall()
         
-        return None
+        ads = {row['id']: self.row_to_ad(row) for row in rows}
+        return [ads[ad_id] for ad_id in dict.fromkeys(ad_ids) if ad_id in ads]
+    
+    @track_queries
+    def get_ad_seller(self, ad_id: int) -> Optional[int]:
+        """Telegram ID продавца объявления"""
+        sellers = self.get_ad_sellers([ad_id])
+        return sellers[0] if sellers else None
+    
+    @track_queries
+    def get_ad_sellers(self, ad_ids: List[int]) -> List[int]:
+        """Telegram ID продавцов объявлений (без повторов)"""
+        with self.read_cursor() as cursor:
+            cursor.execute('''
+                SELECT DISTINCT users.telegram_id
+                FROM ads
+                JOIN users ON ads.user_id = users.id
+                WHERE ads.id IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(ad_ids),))
+            return [row['telegram_id'] for row in cursor.fetchall()]
     
+    @track_queries
     def get_user_by_telegram_id(self, telegram_id: int) -> Optional[Dict]:
         """Получение пользователя по Telegram ID"""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        user = self.users.get(telegram_id)
+        if user is None:
+            with self.read_cursor() as cursor:
+                cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
+                row = cursor.fetchone()
+            if not row:
+                return None
+            user = dict(row)
+            self.users.set(telegram_id, user)
+        # Копия: вызывающий код может менять словарь
+        return dict(user)
     
+    @track_queries
     def toggle_favorite(self, user_id: int, ad_id: int) -> bool:
         """Добавление/удаление из избранного"""
-        cursor = self.conn.cursor()
-        
-        # Проверяем, есть ли уже в избранном
-        cursor.execute('SELECT 1 FROM favorites WHERE user_id = ? AND ad_id = ?', 
-                      (user_id, ad_id))
+        return self.toggle_favorites(user_id, [ad_id]).get(ad_id, False)
+    
+    @track_queries
+    def toggle_favorites(self, user_id: int, ad_ids: List[int]) -> Dict[int, bool]:
+        """Переключение избранного для списка объявлений одной транзакцией
         
-        if cursor.fetchone():
-            # Удаляем из избранного
-            cursor.execute('DELETE FROM favorites WHERE user_id = ? AND ad_id = ?', 
-                          (user_id, ad_id))
-            is_favorite = False
-        else:
-            # Добавляем в избранное
-            cursor.execute('INSERT INTO favorites (user_id, ad_id) VALUES (?, ?)', 
-                          (user_id, ad_id))
-            is_favorite = True
+        Возвращает новое состояние для каждого ID; несуществующие объявления
+        в избранное не добавляются.
+        """
+        ad_ids = list(dict.fromkeys(ad_ids))
+        with self.write_transaction() as cursor:
+            # Снимаем отметку там, где она была...
+            cursor.execute('''
+                DELETE FROM favorites
+                WHERE user_id = ? AND ad_id IN (SELECT value FROM json_each(?))
+                RETURNING ad_id
+            ''', (user_id, json.dumps(ad_ids)))
+            removed = {row['ad_id'] for row in cursor.fetchall()}
+            
+            # ...и ставим на остальных
+            cursor.execute('''
+                INSERT INTO favorites (user_id, ad_id)
+                SELECT ?, ads.id FROM ads
+                WHERE ads.id IN (SELECT value FROM json_each(?))
+                RETURNING ad_id
+            ''', (user_id, json.dumps([ad_id for ad_id in ad_ids if ad_id not in removed])))
+            added = {row['ad_id'] for row in cursor.fetchall()}
         
-        self.conn.commit()
-        return is_favorite
+        return {ad_id: ad_id in added for ad_id in ad_ids}
     
-    def get_user_favorites(self, user_id: int) -> List[Dict]:
-        """Получение избранных объявлений пользователя"""
-        cursor = self.conn.cursor()
+    @track_queries
+    def get_favorite_states(self, user_id: int, ad_ids: List[int]) -> Dict[int, bool]:
+        """Есть ли каждое из объявлений в избранном пользователя"""
+        with self.read_cursor() as cursor:
+            cursor.execute('''
+                SELECT ad_id FROM favorites
+                WHERE user_id = ? AND ad_id IN (SELECT value FROM json_each(?))
+            ''', (user_id, json.dumps(ad_ids)))
+            favorites = {row['ad_id'] for row in cursor.fetchall()}
+        return {ad_id: ad_id in favorites for ad_id in ad_ids}
+    
+    @track_queries
+    def get_user_favorites(self, user_id: int, fields: List[str] = None,
+                           limit: int = None, cursor: str = None,
+                           before: str = None) -> List[Dict]:
+        """Получение избранных объявлений пользователя, от последних добавленных
         
-        cursor.execute('''
-            SELECT ads.*, 
-                   users.telegram_id, 
-                   users.username, 
-                   users.first_name
-            FROM ads
-            JOIN favorites ON ads.id = favorites.ad_id
-            LEFT JOIN users ON ads.user_id = users.id
+        fields - как в get_ads; cursor/before - курсоры encode_cursor(ad, 'favorited_at')
+        для следующей и предыдущей страницы; limit=None - всё избранное.
+        """
+        columns, join_users = select_ad_fields(fields)
+        users_join = 'LEFT JOIN users ON ads.user_id = users.id' if join_users else ''
+        query = f'''
+            SELECT {columns}, favorites.created_at AS favorited_at
+            FROM favorites
+            JOIN ads ON ads.id = favorites.ad_id
+            {users_join}
             WHERE favorites.user_id = ? AND ads.is_active = 1
-            ORDER BY favorites.created_at DESC
-        ''', (user_id,))
+        '''
+        params = [user_id]
         
-        rows = cursor.fetchall()
-        ads = []
-        for row in rows:
-            ad = dict(row)
-            ad['photos'] = json.loads(ad['photos']) if ad['photos'] else []
-            ads.append(ad)
+        position, previous = parse_cursor(cursor), parse_cursor(before)
+        if position:
+            query += ' AND (favorites.created_at, favorites.ad_id) < (?, ?)'
+            params.extend(position)
+        elif previous:
+            query += ' AND (favorites.created_at, favorites.ad_id) > (?, ?)'
+            params.extend(previous)
+        
+        if previous:
+            query += ' ORDER BY favorites.created_at, favorites.ad_id'
+        else:
+            query += ' ORDER BY favorites.created_at DESC, favorites.ad_id DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
         
-        return ads
+        with self.read_cursor() as db_cursor:
+            db_cursor.execute(query, params)
+            rows = db_cursor.fetchall()
+        
+        if previous:
+            rows.reverse()
+        return [self.row_to_ad(row) for row in rows]
+    
+    @track_queries
+    def count_user_ads(self, user_id: int) -> int:
+        """Число активных объявлений пользователя (из seller_stats, без подсчёта строк)"""
+        with self.read_cursor() as cursor:
+            cursor.execute('SELECT total_ads FROM seller_stats WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+            return row['total_ads'] if row else 0
+    
+    @track_queries
+    def count_user_favorites(self, user_id: int) -> int:
+        """Число активных объявлений в избранном пользователя (из favorite_counts)"""
+        with self.read_cursor() as cursor:
+            cursor.execute('SELECT total FROM favorite_counts WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+            return row['total'] if row else 0
+    
+    @track_queries
+    def get_user_favorite_ids(self, user_id: int) -> List[int]:
+        """ID активных объявлений в избранном пользователя"""
+        with self.read_cursor() as cursor:
+            cursor.execute('''
+                SELECT favorites.ad_id
+                FROM favorites
+                JOIN ads ON ads.id = favorites.ad_id
+                WHERE favorites.user_id = ? AND ads.is_active = 1
+                ORDER BY favorites.created_at DESC
+            ''', (user_id,))
+            return [row['ad_id'] for row in cursor.fetchall()]
     
+    @track_queries
     def delete_ad(self, user_id: int, ad_id: int) -> bool:
         """Удаление объявления (деактивация)"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE ads SET is_active = 0 
-            WHERE id = ? AND user_id = ?
-        ''', (ad_id, user_id))
-        
-        affected = cursor.rowcount
-        self.conn.commit()
-        return affected > 0
-    
+        with self.write_transaction() as cursor:
+            cursor.execute('''
+                UPDATE ads SET is_active = 0 
+                WHERE id = ? AND user_id = ?
+            ''', (ad_id, user_id))
+            
+            affected = cursor.rowcount
+            return affected > 0
+
+    @track_queries
+    def archive_ads(self, batch_size: int = 500, ttl_days: float = 0) -> int:
+        """Перенос пачки снятых (и истёкших) объявлений с их избранным в архив
+
+        ttl_days > 0 - активные объявления старше этого срока тоже уходят
+        в архив. Одна пачка - одна короткая транзакция, возвращает число
+        перенесённых объявлений.
+        """
+        with self.write_transaction() as cursor:
+            cursor.execute('SELECT id FROM ads WHERE is_active = 0 ORDER BY id LIMIT ?',
+                           (batch_size,))
+            ad_ids = [row['id'] for row in cursor.fetchall()]
+            if ttl_days > 0 and len(ad_ids) < batch_size:
+                cursor.execute('''
+                    SELECT id FROM ads
+                    WHERE is_active = 1 AND created_at < datetime('now', ?)
+                    ORDER BY created_at, id
+                    LIMIT ?
+                ''', (f'-{ttl_days} days', batch_size - len(ad_ids)))
+                ad_ids += [row['id'] for row in cursor.fetchall()]
+            if not ad_ids:
+                return 0
+
+            batch = json.dumps(ad_ids)
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO ads_archive ({ARCHIVE_AD_COLUMNS})
+                SELECT {ARCHIVE_AD_COLUMNS} FROM ads
+                WHERE id IN (SELECT value FROM json_each(?))
+            ''', (batch,))
+            cursor.execute('''
+                INSERT OR REPLACE INTO favorites_archive (ad_id, user_id, created_at)
+                SELECT ad_id, user_id, created_at FROM favorites
+                WHERE ad_id IN (SELECT value FROM json_each(?))
+            ''', (batch,))
+            # Сначала объявления: триггеры статистики и счётчиков избранного
+            # вычитают активные, пока их избранное ещё на месте
+            cursor.execute('DELETE FROM ads WHERE id IN (SELECT value FROM json_each(?))',
+                           (batch,))
+            cursor.execute('DELETE FROM favorites WHERE ad_id IN (SELECT value FROM json_each(?))',
+                           (batch,))
+            return len(ad_ids)
+
+    @track_queries
+    def incremental_vacuum(self, max_pages: int = 0) -> int:
+        """Возврат свободных страниц файлу (auto_vacuum = INCREMENTAL)
+
+        max_pages - не больше стольких страниц за вызов (0 - все свободные).
+        Возвращает число освобождённых страниц.
+        """
+        with self.write_lock:
+            cursor = self.writer.cursor()
+            before = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+            if not before:
+                return 0
+            # В sqlite3 execute() делает один шаг прагмы - одну страницу;
+            # executescript() выполняет её до конца
+            self.writer.executescript(f'PRAGMA incremental_vacuum({int(max_pages)})')
+            return before - cursor.execute('PRAGMA freelist_count').fetchone()[0]
+
+    def enable_incremental_vacuum(self):
+        """Включение auto_vacuum = INCREMENTAL (для существующей базы - через VACUUM)"""
+        with self.write_lock:
+            cursor = self.writer.cursor(sqlite3.Cursor)
+            if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                return
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            # Режим записан в заголовок, но действует только после пересборки файла
+            logging.getLogger(__name__).info('Включение incremental auto_vacuum (VACUUM)')
+            cursor.execute('VACUUM')
+
+    @track_queries
     def get_user_stats(self, user_id: int) -> Dict:
         """Получение статистики пользователя"""
-        cursor = self.conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_ads,
-                SUM(views) as total_views,
-                COUNT(DISTINCT favorites.ad_id) as total_favorites
-            FROM ads
-            LEFT JOIN favorites ON ads.id = favorites.ad_id
-            WHERE ads.user_id = ? AND ads.is_active = 1
-        ''', (user_id,))
-        
-        stats = dict(cursor.fetchone())
-        
-        # Получаем последние объявления
-        cursor.execute('''
-            SELECT id, title, price, views, created_at
-            FROM ads
-            WHERE user_id = ? AND is_active = 1
-            ORDER BY created_at DESC
-            LIMIT 5
-        ''', (user_id,))
-        
-        stats['recent_ads'] = [dict(row) for row in cursor.fetchall()]
-        
-        return stats
+        with self.read_cursor() as cursor:
+            cursor.execute('''
+                SELECT total_ads, total_views, total_favorites
+                FROM seller_stats
+                WHERE user_id = ?
+            ''', (user_id,))
+            
+            row = cursor.fetchone()
+            stats = dict(row) if row else {'total_ads': 0, 'total_views': 0, 'total_favorites': 0}
+            
+            # Получаем последние объявления
+            cursor.execute('''
+                SELECT id, title, price, views, created_at
+                FROM ads
+                WHERE user_id = ? AND is_active = 1
+                ORDER BY created_at DESC
+                LIMIT 5
+            ''', (user_id,))
+            
+            stats['recent_ads'] = [dict(row) for row in cursor.fetchall()]
+            for ad in stats['recent_ads']:
+                ad['views'] += self.views.pending(ad['id'])
+            
+            return stats
+
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Обслуживание базы данных')
+    parser.add_argument('--db', default=config.DB_PATH, help='путь к файлу базы')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild-favorites', help='пересчитать favorites_count')
+    commands.add_parser('check-stats', help='сверить статистику продавцов')
+    commands.add_parser('rebuild-stats', help='пересчитать статистику продавцов')
+    archive_parser = commands.add_parser('archive',
+                                         help='перенести снятые объявления в архив и сжать файл')
+    archive_parser.add_argument('--ttl-days', type=float, default=config.AD_TTL_DAYS,
+                                help='архивировать и активные объявления старше срока')
+    report_parser = commands.add_parser('slow-report',
+                                        help='самые дорогие запросы из журнала медленных запросов')
+    report_parser.add_argument('--log', default=config.SLOW_QUERY_LOG, help='файл журнала')
+    report_parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+    
+    if args.command == 'slow-report':
+        # Отчёт строится по журналу и не открывает базу
+        print(json.dumps(slow_query_report(args.log, args.top), ensure_ascii=False, indent=2))
+        raise SystemExit(0)
+    
+    db = Database(args.db)
+    if args.command == 'rebuild-favorites':
+        print(f'Исправлено объявлений: {db.rebuild_favorites_count()}')
+    elif args.command == 'check-stats':
+        mismatches = db.check_seller_stats()
+        for mismatch in mismatches:
+            print(mismatch)
+        print(f'Расхождений: {len(mismatches)}')
+        raise SystemExit(1 if mismatches else 0)
+    elif args.command == 'rebuild-stats':
+        print(f'Пересчитано продавцов: {db.rebuild_seller_stats()}')
+        print(f'Пересчитано счётчиков избранного: {db.rebuild_favorite_counts()}')
+    elif args.command == 'archive':
+        archived = 0
+        while True:
+            moved = db.archive_ads(config.ARCHIVE_BATCH_SIZE, args.ttl_days)
+            archived += moved
+            if moved < config.ARCHIVE_BATCH_SIZE:
+                break
+        print(f'Перенесено в архив: {archived}')
+        print(f'Освобождено страниц: {db.incremental_vacuum()}')
@@ -0,0 +1,278 @@
+"""Локальный фейковый Bot API: проверка бота без обращения к Telegram
+
+Сервер отвечает как api.telegram.org и записывает все вызовы; бот
+направляется на него через BOT_API_URL. Проверки (код выхода 1 при ошибке):
+    python fake_bot_api.py webhook
+    python fake_bot_api.py alerts
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+from aiohttp import web
+import config
+
+WEBHOOK_SECRET = 'fake-secret'
+
+
+class FakeBotAPI:
+    """HTTP-сервер с методами Bot API и журналом полученных вызовов
+
+    failures[chat_id] - очередь ошибок, которые получат следующие запросы
+    к этому чату: (код, описание, параметры), например (429, ..., {'retry_after': 1}).
+    """
+
+    def __init__(self):
+        self.calls: List[Dict] = []
+        self.failures: Dict[str, List[Tuple[int, str, Dict]]] = {}
+        self.runner = None
+        self.url = None
+        self.message_id = 0
+
+    async def start(self) -> str:
+        """Запуск на свободном порту, возвращает базовый URL для BOT_API_URL"""
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+        return self.url
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post())
+        call = {'time': time.monotonic(), 'method': method, 'params': params, 'ok': True}
+        self.calls.append(call)
+
+        queued = self.failures.get(str(params.get('chat_id')))
+        if queued:
+            status, description, parameters = queued.pop(0)
+            call['ok'] = False
+            payload = {'ok': False, 'error_code': status, 'description': description}
+            if parameters:
+                payload['parameters'] = parameters
+            return web.json_response(payload, status=status)
+        # Как Telegram: текст длиннее 4096 символов отклоняется (здесь - вместе с разметкой)
+        if len(params.get('text', '')) > 4096:
+            call['ok'] = False
+            return web.json_response({'ok': False, 'error_code': 400,
+                                      'description': 'Bad Request: message is too long'},
+                                     status=400)
+        return web.json_response({'ok': True, 'result': self.result(method, params)})
+
+    def result(self, method: str, params: Dict):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+        if method in ('sendMessage', 'editMessageText'):
+            self.message_id += 1
+            return {'message_id': self.message_id, 'date': int(time.time()),
+                    'chat': {'id': int(params['chat_id']), 'type': 'private'},
+                    'text': params.get('text', '')}
+        return True
+
+    def sent(self, method: str = 'sendMessage') -> List[Dict]:
+        """Успешные вызовы метода по порядку"""
+        return [call for call in self.calls if call['method'] == method and call['ok']]
+
+    async def wait_for(self, predicate: Callable[[], bool], timeout: float = 5) -> bool:
+        """Ожидание условия по журналу вызовов"""
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    async def close(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+def message_update(update_id: int, user_id: int, text: str) -> Dict:
+    """Обновление с текстовым сообщением от пользователя"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}',
+            'username': f'user{user_id}'}
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': text, 'from': user,
+        'chat': {'id': user_id, 'type': 'private'},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        if text.startswith('/') else []
+    }}
+
+
+async def check_webhook(api: FakeBotAPI) -> List[Tuple[str, bool, str]]:
+    """Вебхук async-сервера от запроса Telegram до ответа бота через Bot API"""
+    from aiohttp import ClientSession
+    import bot
+    from async_server import WebhookHandler, create_app
+
+    checks = []
+    await bot.bot.set_webhook(f'{api.url}/webhook', secret_token=WEBHOOK_SECRET)
+    webhook_calls = api.sent('setWebhook')
+    checks.append(('setWebhook получает secret_token',
+                   bool(webhook_calls) and webhook_calls[-1]['params'].get('secret_token')
+                   == WEBHOOK_SECRET, ''))
+
+    handler = WebhookHandler(bot.dp, WEBHOOK_SECRET, max_in_flight=10)
+    runner = web.AppRunner(create_app(webhook=handler), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{config.WEBHOOK_PATH}'
+    headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET}
+
+    try:
+        async with ClientSession() as session:
+            async with session.post(url, json=message_update(1, 42, '/start'),
+                                    headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'}) as r:
+                checks.append(('неверный секрет - 401', r.status == 401, str(r.status)))
+            for body in ('not json', '[1, 2]', '"text"'):
+                async with session.post(url, data=body, headers=headers) as r:
+                    checks.append((f'тело {body} - 400', r.status == 400, str(r.status)))
+
+            started = time.monotonic()
+            async with session.post(url, json=message_update(2, 42, '/start'),
+                                    headers=headers) as r:
+                checks.append(('обновление принято - 200', r.status == 200, str(r.status)))
+            answered = await api.wait_for(lambda: any(
+                call['params'].get('chat_id') == '42' for call in api.sent()))
+            checks.append(('/start отвечает через Bot API', answered,
+                           f'{(time.monotonic() - started) * 1000:.1f} мс'))
+
+            # Пачка параллельных обновлений: все обработаны, ответы не потеряны
+            updates = [message_update(100 + n, 1000 + n, '/start') for n in range(30)]
+            await asyncio.gather(*[session.post(url, json=update, headers=headers)
+                                   for update in updates])
+            answered = await api.wait_for(lambda: {call['params'].get('chat_id')
+                                                   for call in api.sent()}
+                                          >= {str(1000 + n) for n in range(30)})
+            checks.append(('30 параллельных обновлений обработаны', answered, ''))
+    finally:
+        await runner.cleanup()
+    return checks
+
+
+async def check_alerts(api: FakeBotAPI, users: int = 60) -> List[Tuple[str, bool, str]]:
+    """Рассылка по сохранённым поискам через AlertSender
+
+    Одно сообщение на пользователя, ограничение частоты, пауза по RetryAfter,
+    отказ от повторов для пользователей, заблокировавших бот, и длина
+    сообщения в пределах лимита Bot API при очень длинных названиях.
+    """
+    import bot
+    from alerts import AlertSender
+    from async_database import AsyncDatabase
+
+    db = bot.db.db
+    seller_telegram_id, blocked, limited, long_titles = 10 ** 6, 5, 7, 3
+    db.register_user(seller_telegram_id, 'seller', 'Seller')
+    seller = db.get_user_by_telegram_id(seller_telegram_id)['id']
+    expected = {}
+    for telegram_id in range(1, users + 1):
+        db.register_user(telegram_id, f'user{telegram_id}', 'User')
+        user_id = db.get_user_by_telegram_id(telegram_id)['id']
+        db.create_saved_search(user_id, 'манго')
+        expected[str(telegram_id)] = 2
+        if telegram_id % 10 == 2:
+            db.create_saved_search(user_id, 'арбуз')
+            expected[str(telegram_id)] = 3
+    for title in ('Жидкость манго', 'Манго лёд', 'Арбуз'):
+        db.create_ad(seller, title, '', 300, 'жидкость', [], '', 'telegram')
+    # Десять объявлений с названиями по 2000 символов - одному пользователю
+    db.create_saved_search(db.get_user_by_telegram_id(long_titles)['id'], 'дыня')
+    for n in range(10):
+        db.create_ad(seller, f'Дыня {n} ' + '&' * 2000, '', 300, 'жидкость', [], '', 'telegram')
+
+    api.failures[str(blocked)] = [(403, 'Forbidden: bot was blocked by the user', {})]
+    api.failures[str(limited)] = [(429, 'Too Many Requests: retry after 1', {'retry_after': 1})]
+
+    sender = AlertSender(bot.bot, AsyncDatabase(db), interval=0.1)
+    started = time.monotonic()
+    sender.start()
+    drained = await api.wait_for(lambda: not db.get_pending_alerts(), timeout=30)
+    await sender.close()
+    elapsed = time.monotonic() - started
+
+    checks = [('очередь уведомлений разобрана', drained, f'{elapsed:.2f} с')]
+    sent = api.sent()
+    per_chat = {}
+    for call in sent:
+        per_chat.setdefault(call['params']['chat_id'], []).append(call['params']['text'])
+    delivered = {chat: expected[chat] for chat in expected if chat != str(blocked)}
+    checks.append(('одно сообщение на пользователя',
+                   set(per_chat) == set(delivered)
+                   and all(len(texts) == 1 for texts in per_chat.values()),
+                   f'{len(sent)} сообщений, {len(per_chat)} чатов'))
+    checks.append(('все объявления пользователя в одном сообщении',
+                   all(per_chat.get(chat, [''])[0].count('•') == count
+                       for chat, count in delivered.items() if chat != str(long_titles)), ''))
+    long_text = per_chat.get(str(long_titles), [''])[0]
+    checks.append(('длинные названия: сообщение не длиннее 4096 символов',
+                   0 < len(long_text) <= 4096 and 'И ещё' in long_text,
+                   f'{len(long_text)} символов'))
+    blocked_calls = [call for call in api.calls
+                     if call['params'].get('chat_id') == str(blocked)]
+    checks.append(('заблокировавший бот: одна попытка, без повторов',
+                   len(blocked_calls) == 1, f'{len(blocked_calls)} попыток'))
+
+    # Ограничение частоты: в любом окне в 1 с не больше rate (+1 на начальный запас)
+    times = sorted(call['time'] for call in api.calls if call['method'] == 'sendMessage')
+    window = max(sum(1 for other in times if start <= other < start + 1) for start in times)
+    checks.append(('не больше ALERT_RATE сообщений в секунду',
+                   window <= config.ALERT_RATE + 1,
+                   f'максимум {window} за 1 с при лимите {config.ALERT_RATE:g}'))
+
+    # RetryAfter останавливает всю рассылку на указанное время
+    limited_at = next(call['time'] for call in api.calls
+                      if call['params'].get('chat_id') == str(limited) and not call['ok'])
+    during_pause = [other for other in times if limited_at + 0.1 < other < limited_at + 0.95]
+    checks.append(('RetryAfter приостанавливает все отправки', not during_pause,
+                   f'{len(during_pause)} отправок во время паузы'))
+    checks.append(('после RetryAfter сообщение доставлено', str(limited) in per_chat, ''))
+    return checks
+
+
+CHECKS = {'webhook': check_webhook, 'alerts': check_alerts}
+
+
+async def run_check(name: str) -> List[Tuple[str, bool, str]]:
+    api = FakeBotAPI()
+    await api.start()
+    # Бот читает адрес Bot API при импорте
+    config.BOT_API_URL = api.url
+    try:
+        return await CHECKS[name](api)
+    finally:
+        import bot
+        await bot.bot.close()
+        await api.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Проверки бота на локальном фейковом Bot API')
+    parser.add_argument('check', choices=sorted(CHECKS))
+    args = parser.parse_args()
+
+    # База и фото - во временном каталоге, токен - любой корректный по формату
+    workdir = tempfile.mkdtemp(prefix='vape_fake_api_')
+    config.DB_PATH = os.path.join(workdir, 'fake_api.db')
+    config.MEDIA_ROOT = os.path.join(workdir, 'media')
+    config.BOT_TOKEN = '123456:fake-token'
+    try:
+        results = asyncio.run(run_check(args.check))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, ok, detail in results:
+        print(f'{"OK  " if ok else "FAIL"} {name} {detail}'.rstrip(), file=sys.stderr)
+    print(json.dumps([{'check': name, 'ok': ok, 'detail': detail}
+                      for name, ok, detail in results], ensure_ascii=False, indent=2))
+    raise SystemExit(0 if all(ok for _, ok, _ in results) else 1)
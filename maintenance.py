@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import Dict
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class MaintenanceJob:
+    """Фоновое обслуживание базы по расписанию
+
+    Снятые (и истёкшие) объявления пачками переносятся в архив, чтобы
+    горячие таблицы и индексы оставались маленькими, затем освободившиеся
+    страницы возвращаются файлу через incremental vacuum. Каждая пачка -
+    отдельная короткая транзакция, записи бота и Mini App идут между ними.
+    """
+
+    def __init__(self, db, interval: float = None, batch_size: int = None,
+                 max_batches: int = None, ttl_days: float = None, vacuum_pages: int = None):
+        self.db = db
+        self.interval = config.MAINTENANCE_INTERVAL if interval is None else interval
+        self.batch_size = batch_size or config.ARCHIVE_BATCH_SIZE
+        self.max_batches = max_batches or config.ARCHIVE_MAX_BATCHES
+        self.ttl_days = config.AD_TTL_DAYS if ttl_days is None else ttl_days
+        self.vacuum_pages = config.VACUUM_PAGES if vacuum_pages is None else vacuum_pages
+        self.stopped = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        """Запуск фоновой задачи в текущем цикле событий (interval = 0 - выключено)"""
+        if self.interval > 0:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while not self.stopped.is_set():
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception('Ошибка обслуживания базы')
+            try:
+                await asyncio.wait_for(self.stopped.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_once(self) -> Dict[str, int]:
+        """Один проход: архивирование ограниченного числа пачек и vacuum"""
+        archived = 0
+        for _ in range(self.max_batches):
+            if self.stopped.is_set():
+                break
+            moved = await self.db.archive_ads(self.batch_size, self.ttl_days)
+            archived += moved
+            if moved < self.batch_size:
+                break
+        freed_pages = await self.db.incremental_vacuum(self.vacuum_pages)
+        if archived or freed_pages:
+            logger.info('Перенесено в архив: %s, освобождено страниц: %s', archived, freed_pages)
+        return {'archived': archived, 'freed_pages': freed_pages}
+
+    async def close(self):
+        """Остановка после текущей пачки"""
+        self.stopped.set()
+        if self.task:
+            await self.task
@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+try:
+    from PIL import Image
+except ImportError:  # без Pillow превью не строятся, отдаются оригиналы
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Превью: карточка ленты и экран объявления (максимальная сторона в пикселях)
+THUMBNAIL_SIZES = {
+    'card': 400,
+    'detail': 1280
+}
+
+# Допустимые форматы определяются по сигнатуре файла, а не по имени
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+]
+
+MEDIA_NAME_RE = re.compile(r'^([0-9a-f]{64})(?:_(card|detail))?\.(jpg|png|gif|webp)$')
+
+
+def detect_image_extension(header: bytes) -> Optional[str]:
+    """Расширение файла по первым байтам или None, если это не изображение"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return '.webp'
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    return None
+
+
+class HashingFile:
+    """Временный файл на диске, который считает SHA-256 по мере записи"""
+
+    def __init__(self, directory: str):
+        self.file = tempfile.NamedTemporaryFile(dir=directory, suffix='.upload', delete=False)
+        self.hash = hashlib.sha256()
+        self.header = b''
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.hash.update(data)
+        if len(self.header) < 16:
+            self.header += data[:16 - len(self.header)]
+        self.size += len(data)
+        return self.file.write(data)
+
+    def discard(self):
+        """Удаление временного файла"""
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.unlink(self.file.name)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class MediaStore:
+    """Хранилище фото с адресацией по содержимому и фоновой генерацией превью
+
+    Файл сохраняется под именем своего SHA-256, поэтому повторная загрузка
+    того же фото не занимает места, а URL никогда не меняет содержимое.
+    """
+
+    def __init__(self, root: str, url_prefix: str = '/media', workers: int = 2):
+        self.root = os.path.abspath(root)
+        self.url_prefix = url_prefix
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+
+    def open_upload(self) -> HashingFile:
+        """Новый приёмник для потоковой записи загружаемого файла"""
+        return HashingFile(self.tmp_dir)
+
+    def path_for(self, name: str) -> Optional[str]:
+        """Путь к файлу хранилища по имени из URL (только корректные имена)"""
+        match = MEDIA_NAME_RE.match(name)
+        if not match:
+            return None
+        return os.path.join(self.root, match.group(1)[:2], name)
+
+    def save(self, upload: HashingFile) -> str:
+        """Перенос загрузки в хранилище, возвращает URL оригинала"""
+        upload.file.close()
+        extension = detect_image_extension(upload.header)
+        if extension is None:
+            upload.discard()
+            raise ValueError('Unsupported image format')
+
+        digest = upload.hash.hexdigest()
+        name = digest + extension
+        path = self.path_for(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if os.path.exists(path):
+            # Такое фото уже загружали
+            upload.discard()
+        else:
+            os.replace(upload.file.name, path)
+
+        if Image is not None:
+            self.executor.submit(self.make_thumbnails, path, digest)
+        return f'{self.url_prefix}/{name}'
+
+    def make_thumbnails(self, path: str, digest: str):
+        """Генерация недостающих превью (выполняется в фоновом потоке)"""
+        try:
+            for size_name, max_side in THUMBNAIL_SIZES.items():
+                target = self.path_for(f'{digest}_{size_name}.webp')
+                if os.path.exists(target):
+                    continue
+                with Image.open(path) as image:
+                    image.thumbnail((max_side, max_side))
+                    if image.mode not in ('RGB', 'RGBA'):
+                        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                    # Пишем во временный файл и подменяем атомарно
+                    fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix='.webp')
+                    with os.fdopen(fd, 'wb') as tmp_file:
+                        image.save(tmp_file, 'WEBP', quality=80, method=4)
+                os.replace(tmp_path, target)
+        except Exception:
+            logger.exception('Не удалось построить превью для %s', path)
+
+    def thumbnail_url(self, url: str, size_name: str) -> str:
+        """URL превью для фото из хранилища, внешние URL возвращаются как есть"""
+        if not url or not url.startswith(self.url_prefix + '/'):
+            return url
+        match = MEDIA_NAME_RE.match(url[len(self.url_prefix) + 1:])
+        if not match or match.group(2):
+            return url
+        return f'{self.url_prefix}/{match.group(1)}_{size_name}.webp'
+
+    def original_path(self, name: str) -> Optional[str]:
+        """Путь к оригиналу, из которого построено превью"""
+        match = MEDIA_NAME_RE.match(name)
+        if not match:
+            return None
+        directory = os.path.join(self.root, match.group(1)[:2])
+        if not os.path.isdir(directory):
+            return None
+        for candidate in os.listdir(directory):
+            original = MEDIA_NAME_RE.match(candidate)
+            if original and original.group(1) == match.group(1) and not original.group(2):
+                return os.path.join(directory, candidate)
+        return None
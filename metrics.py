@@ -0,0 +1,239 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Границы корзин гистограмм задержки (сек)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    """Метки в формате Prometheus: {name="value",...}"""
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Общая часть метрик: имя, описание, метки и значения по наборам меток"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple, object] = {}
+        self.lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def samples(self) -> Iterable[str]:
+        with self.lock:
+            items = sorted(self.values.items())
+        for label_values, value in items:
+            yield f'{self.name}{format_labels(self.labels, label_values)} {format_value(value)}'
+
+    def render(self) -> List[str]:
+        return self.header() + list(self.samples())
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик"""
+
+    kind = 'counter'
+
+    def inc(self, *label_values, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение, которое может расти и уменьшаться"""
+
+    kind = 'gauge'
+
+    def inc(self, *label_values, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+
+class CallbackMetric(Metric):
+    """Метрика, значения которой вычисляются в момент чтения /metrics
+
+    Подходит для счётчиков, которые уже ведутся в других объектах
+    (например, попадания в кэш), чтобы не трогать их горячий путь.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str],
+                 collect: Callable[[], Dict[Tuple, float]], kind: str = 'gauge'):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        for label_values, value in sorted(self.collect().items()):
+            yield f'{self.name}{format_labels(self.labels, label_values)} {format_value(value)}'
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам с суммой и количеством"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values):
+        # Каждое значение попадает в одну корзину, накопленные суммы
+        # считаются только при выводе
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        with self.lock:
+            items = sorted((key, ([*counts], total, count))
+                           for key, (counts, total, count) in self.values.items())
+        for label_values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = format_labels(self.labels, label_values, f'le="{format_value(bound)}"')
+                yield f'{self.name}_bucket{le} {cumulative}'
+            labels = format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {total!r}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Registry:
+    """Набор метрик процесса и вывод в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.caches: List[Tuple[str, object]] = []
+        self.lock = threading.Lock()
+        self.register(CallbackMetric('cache_hits_total', 'Попадания в кэш',
+                                     ['cache'], lambda: self.cache_counts('hits'), 'counter'))
+        self.register(CallbackMetric('cache_misses_total', 'Промахи кэша',
+                                     ['cache'], lambda: self.cache_counts('misses'), 'counter'))
+        self.register(CallbackMetric('cache_entries', 'Записей в кэше',
+                                     ['cache'], lambda: self.cache_counts(len)))
+
+    def register(self, metric: Metric) -> Metric:
+        """Регистрация метрики; повторная регистрация возвращает существующую"""
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def register_cache(self, name: str, cache):
+        """Учёт попаданий и промахов LRUCache под заданным именем"""
+        with self.lock:
+            self.caches.append((name, cache))
+
+    def cache_counts(self, field) -> Dict[Tuple, float]:
+        # Кэши с одинаковым именем (например, у нескольких Database) суммируются
+        counts = {}
+        for name, cache in list(self.caches):
+            value = field(cache) if callable(field) else getattr(cache, field)
+            counts[(name,)] = counts.get((name,), 0) + value
+        return counts
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Общий реестр процесса: бот и веб-приложение пишут в одни метрики
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    'http_requests_total', 'HTTP-запросы по маршруту и коду ответа',
+    ['method', 'route', 'status'])
+HTTP_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Время обработки HTTP-запроса',
+    ['method', 'route'])
+HTTP_IN_FLIGHT = registry.gauge(
+    'http_requests_in_flight', 'HTTP-запросы в обработке')
+
+DB_CALLS = registry.histogram(
+    'db_method_duration_seconds', 'Время выполнения методов Database', ['method'])
+DB_QUERIES = registry.counter(
+    'db_queries_total', 'SQL-запросы, выполненные методами Database', ['method'])
+DB_QUERY_DURATION = registry.histogram(
+    'db_query_duration_seconds', 'Время выполнения отдельных SQL-запросов', ['method'])
+DB_ERRORS = registry.counter(
+    'db_method_errors_total', 'Методы Database, завершившиеся исключением', ['method'])
+
+BOT_HANDLER_DURATION = registry.histogram(
+    'bot_handler_duration_seconds', 'Время обработки команд и колбэков бота',
+    ['update', 'handler'])
+
+# Метод Database, который выполняется в текущем потоке (для подсчёта SQL)
+current = threading.local()
+
+
+def track_queries(method):
+    """Декоратор метода Database: длительность, ошибки и метка для SQL-запросов"""
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        outer = getattr(current, 'method', None)
+        current.method = name
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(name)
+            raise
+        finally:
+            DB_CALLS.observe(time.perf_counter() - started, name)
+            current.method = outer
+    return wrapper
+
+
+
+def observe_query(elapsed: float):
+    """Учёт одного SQL-запроса за методом Database, который выполняется в потоке"""
+    method = getattr(current, 'method', None) or 'other'
+    DB_QUERIES.inc(method)
+    DB_QUERY_DURATION.observe(elapsed, method)
@@ -7,8 +7,11 @@ class VapeMarketplace {
         this.currentScreen = 'main';
         this.selectedCategory = null;
         this.photos = [];
-        this.offset = 0;
+        this.nextCursor = null;
         this.limit = 10;
+        this.sort = 'newest';
+        this.favoriteIds = new Set();
+        this.stats = null;
         
         this.init();
     }
@@ -22,13 +25,9 @@ class VapeMarketplace {
         const urlParams = new URLSearchParams(window.location.search);
         const userId = urlParams.get('user_id');
         
-        if (userId) {
-            await this.loadUser(parseInt(userId));
-        }
-        
-        // Загружаем категории и объявления
-        await this.loadCategories();
-        await this.loadAds();
+        // Пользователь, категории, первая страница ленты, избранное
+        // и статистика приходят одним запросом
+        await this.loadBootstrap(userId ? parseInt(userId) : null);
         
         // Инициализируем UI
         this.initUI();
@@ -39,6 +38,28 @@ class VapeMarketplace {
         document.getElementById('main-screen').classList.remove('hidden');
     }
     
+    async loadBootstrap(userId) {
+        try {
+            let url = `/api/bootstrap?limit=${this.limit}`;
+            if (userId) {
+                url += `&user_id=${userId}`;
+            }
+            
+            const response = await fetch(url);
+            if (response.ok) {
+                const data = await response.json();
+                this.currentUser = data.user && data.user.id ? data.user : null;
+                this.categories = data.categories;
+                this.ads = data.ads;
+                this.nextCursor = data.next_cursor;
+                this.favoriteIds = new Set(data.favorite_ids);
+                this.stats = data.stats;
+            }
+        } catch (error) {
+            console.error('Ошибка начальной загрузки:', error);
+        }
+    }
+    
     async loadUser(userId) {
         try {
             const response = await fetch(`/api/user/${userId}`);
@@ -65,21 +86,21 @@ class VapeMarketplace {
     
     async loadAds(category = null, reset = true) {
         if (reset) {
-            this.offset = 0;
+            this.nextCursor = null;
             this.ads = [];
         }
         
         try {
-            let url = `/api/ads?limit=${this.limit}&offset=${this.offset}`;
+            let url = `/api/ads?view=card&limit=${this.limit}&sort=${this.sort}&cursor=${encodeURIComponent(this.nextCursor || '')}`;
             if (category) {
                 url += `&category=${encodeURIComponent(category)}`;
             }
             
             const response = await fetch(url);
             if (response.ok) {
-                const newAds = await response.json();
-                this.ads = reset ? newAds : [...this.ads, ...newAds];
-                this.offset += newAds.length;
+                const page = await response.json();
+                this.ads = reset ? page.ads : [...this.ads, ...page.ads];
+                this.nextCursor = page.next_cursor;
                 this.updateAdsUI();
             }
         } catch (error) {
@@ -162,9 +183,9 @@ class VapeMarketplace {
             adCard.className = 'ad-card';
             adCard.dataset.id = ad.id;
             
-            const photoUrl = ad.photos && ad.photos.length > 0 
+            const photoUrl = ad.thumbnail || (ad.photos && ad.photos.length > 0 
                 ? ad.photos[0] 
-                : 'https://via.placeholder.com/300x200/7B1FA2/FFFFFF?text=Vape';
+                : 'https://via.placeholder.com/300x200/7B1FA2/FFFFFF?text=Vape');
             
             adCard.innerHTML = `
                 <div class="ad-image">
@@ -184,7 +205,7 @@ class VapeMarketplace {
         // Показываем/скрываем кнопку "Показать еще"
         const loadMoreBtn = document.getElementById('load-more-btn');
         if (loadMoreBtn) {
-            loadMoreBtn.style.display = this.ads.length >= this.offset ? 'block' : 'none';
+            loadMoreBtn.style.display = this.nextCursor ? 'block' : 'none';
         }
     }
     
@@ -204,8 +225,14 @@ class VapeMarketplace {
                 : 'Без username';
         }
         
-        // Загружаем статистику
-        this.loadUserStats();
+        // Статистика из начальной загрузки используется один раз,
+        // дальше она запрашивается заново
+        if (this.stats) {
+            this.updateStatsUI(this.stats);
+            this.stats = null;
+        } else {
+            this.loadUserStats();
+        }
     }
     
     async loadUserStats() {
@@ -275,6 +302,21 @@ class VapeMarketplace {
             });
         }
         
+        // Порядок ленты
+        const sortSelect = document.getElementById('sort-select');
+        if (sortSelect) {
+            sortSelect.addEventListener('change', (e) => {
+                this.sort = e.target.value;
+                this.loadAds(this.selectedCategory, true);
+            });
+        }
+        
+        // Подписка на новые объявления по текущему поиску
+        const saveSearchBtn = document.getElementById('save-search-btn');
+        if (saveSearchBtn) {
+            saveSearchBtn.addEventListener('click', () => this.saveSearch(saveSearchBtn));
+        }
+        
         // Кнопка создания объявления
         const createBtn = document.getElementById('create-ad-btn');
         if (createBtn) {
@@ -382,7 +424,7 @@ class VapeMarketplace {
         }
         
         try {
-            let url = `/api/ads?search=${encodeURIComponent(query)}&limit=${this.limit}`;
+            let url = `/api/ads?view=card&search=${encodeURIComponent(query)}&limit=${this.limit}`;
             if (this.selectedCategory) {
                 url += `&category=${encodeURIComponent(this.selectedCategory)}`;
             }
@@ -390,6 +432,7 @@ class VapeMarketplace {
             const response = await fetch(url);
             if (response.ok) {
                 this.ads = await response.json();
+                this.nextCursor = null;
                 this.updateAdsUI();
             }
         } catch (error) {
@@ -397,6 +440,46 @@ class VapeMarketplace {
         }
     }
     
+    async saveSearch(buttonElement) {
+        if (!this.currentUser) {
+            this.showScreen('profile');
+            return;
+        }
+        
+        const query = document.getElementById('search-input').value.trim();
+        if (!query && !this.selectedCategory) {
+            alert('Введите запрос или выберите категорию');
+            return;
+        }
+        
+        try {
+            const response = await fetch('/api/save_search', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    user_id: this.currentUser.telegram_id,
+                    query: query,
+                    category: this.selectedCategory
+                })
+            });
+            
+            const result = await response.json();
+            if (response.ok && result.success) {
+                const icon = buttonElement.querySelector('i');
+                if (icon) {
+                    icon.className = 'fas fa-bell';
+                }
+                alert('Бот пришлёт уведомление о новых объявлениях по этому поиску');
+            } else {
+                alert(`Ошибка: ${result.error}`);
+            }
+        } catch (error) {
+            console.error('Ошибка сохранения поиска:', error);
+        }
+    }
+    
     async showAdDetail(adId) {
         try {
             const response = await fetch(`/api/ad/${adId}`);
@@ -455,8 +538,9 @@ class VapeMarketplace {
         if (galleryElement) {
             galleryElement.innerHTML = '';
             
-            if (ad.photos && ad.photos.length > 0) {
-                ad.photos.forEach(photoUrl => {
+            const photos = ad.photos_detail || ad.photos;
+            if (photos && photos.length > 0) {
+                photos.forEach(photoUrl => {
                     const imgContainer = document.createElement('div');
                     imgContainer.className = 'gallery-image';
                     imgContainer.innerHTML = `
@@ -495,6 +579,10 @@ class VapeMarketplace {
         // Кнопка избранного
         const favoriteBtn = document.getElementById('ad-favorite-btn');
         if (favoriteBtn && this.currentUser) {
+            const icon = favoriteBtn.querySelector('i');
+            if (icon) {
+                icon.className = this.favoriteIds.has(ad.id) ? 'fas fa-heart' : 'far fa-heart';
+            }
             favoriteBtn.onclick = () => this.toggleFavorite(ad.id, favoriteBtn);
         }
     }
@@ -519,6 +607,11 @@ class VapeMarketplace {
             
             if (response.ok) {
                 const result = await response.json();
+                if (result.is_favorite) {
+                    this.favoriteIds.add(adId);
+                } else {
+                    this.favoriteIds.delete(adId);
+                }
                 if (buttonElement) {
                     const icon = buttonElement.querySelector('i');
                     if (icon) {
@@ -540,7 +633,7 @@ class VapeMarketplace {
         }
         
         try {
-            const response = await fetch(`/api/user_favorites/${this.currentUser.telegram_id}`);
+            const response = await fetch(`/api/user_favorites/${this.currentUser.telegram_id}?view=card`);
             if (response.ok) {
                 const favorites = await response.json();
                 this.updateFavoritesUI(favorites);
@@ -574,7 +667,7 @@ class VapeMarketplace {
             adItem.className = 'favorite-item';
             adItem.innerHTML = `
                 <div class="favorite-image">
-                    <img src="${ad.photos && ad.photos.length > 0 ? ad.photos[0] : 'https://via.placeholder.com/100x100/7B1FA2/FFFFFF?text=Vape'}" 
+                    <img src="${ad.thumbnail || (ad.photos && ad.photos.length > 0 ? ad.photos[0] : 'https://via.placeholder.com/100x100/7B1FA2/FFFFFF?text=Vape')}" 
                          alt="${ad.title}">
                 </div>
                 <div class="favorite-info">
@@ -661,9 +754,9 @@ class VapeMarketplace {
             const adItem = document.createElement('div');
             adItem.className = 'my-ad-item';
             
-            const photoUrl = ad.photos && ad.photos.length > 0 
+            const photoUrl = ad.thumbnail || (ad.photos && ad.photos.length > 0 
                 ? ad.photos[0] 
-                : 'https://via.placeholder.com/100x100/7B1FA2/FFFFFF?text=Vape';
+                : 'https://via.placeholder.com/100x100/7B1FA2/FFFFFF?text=Vape');
             
             adItem.innerHTML = `
                 <div class="my-ad-image">
@@ -761,13 +854,36 @@ class VapeMarketplace {
     }
     
     async uploadPhotoFromGallery() {
-        // В реальном приложении здесь будет вызов API загрузки файлов
-        // Для демо используем заглушку
-        
         this.hideModal('photo');
         
-        // Добавляем заглушечное фото
-        this.addPhoto('https://via.placeholder.com/400x300/7B1FA2/FFFFFF?text=Vape+Photo');
+        // Выбор файла из галереи
+        const input = document.createElement('input');
+        input.type = 'file';
+        input.accept = 'image/*';
+        input.addEventListener('change', async () => {
+            const file = input.files[0];
+            if (!file) return;
+            
+            const formData = new FormData();
+            formData.append('photo', file);
+            
+            try {
+                const response = await fetch('/upload_photo', {
+                    method: 'POST',
+                    body: formData
+                });
+                const result = await response.json();
+                if (response.ok && result.success) {
+                    this.addPhoto(result.url);
+                } else {
+                    alert(`Ошибка: ${result.error}`);
+                }
+            } catch (error) {
+                console.error('Ошибка загрузки фото:', error);
+                alert('Ошибка при загрузке фото');
+            }
+        });
+        input.click();
     }
     
     addPhoto(url) {
@@ -0,0 +1,75 @@
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, Iterable, Optional, Tuple
+from compression import compress, supported_encodings
+
+# Отпечаток в имени файла: script.3f2a9c1b7d4e.js
+FINGERPRINT_RE = re.compile(r'^(.+)\.([0-9a-f]{12})(\.[A-Za-z0-9]+)$')
+
+# Файлы с отпечатком не меняются никогда, оболочка - перепроверяется часто
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+SHORT_CACHE_CONTROL = 'public, max-age=60'
+
+
+class Asset:
+    """Файл статики в памяти со сжатыми вариантами"""
+
+    def __init__(self, name: str, body: bytes):
+        self.name = name
+        self.body = body
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.variants = {encoding: compress(body, encoding, best=True)
+                         for encoding in supported_encodings()}
+        base, extension = os.path.splitext(name)
+        self.fingerprinted_name = f'{base}.{self.digest[:12]}{extension}'
+
+    def representation(self, encoding: Optional[str]) -> Tuple[bytes, str]:
+        """Тело и ETag для кодировки (None - без сжатия)"""
+        if encoding and encoding in self.variants:
+            return self.variants[encoding], f'{self.digest[:16]}-{encoding}'
+        return self.body, self.digest[:16]
+
+
+class StaticAssets:
+    """Раздача оболочки Mini App только из явного списка файлов
+
+    Файлы читаются и сжимаются один раз при запуске. В index.html ссылки на
+    остальные файлы заменяются именами с отпечатком содержимого, поэтому
+    их можно кэшировать навсегда, а сама оболочка кэшируется ненадолго.
+    """
+
+    def __init__(self, root: str, names: Iterable[str], entry: str = 'index.html'):
+        self.entry = entry
+        self.assets: Dict[str, Asset] = {}
+        for name in names:
+            if name == entry:
+                continue
+            with open(os.path.join(root, name), 'rb') as f:
+                self.assets[name] = Asset(name, f.read())
+
+        with open(os.path.join(root, entry), 'rb') as f:
+            html = f.read().decode('utf-8')
+        for asset in self.assets.values():
+            html = re.sub(rf'((?:href|src)=["\'])(?:\./)?{re.escape(asset.name)}(["\'])',
+                          rf'\g<1>{asset.fingerprinted_name}\g<2>', html)
+        self.assets[entry] = Asset(entry, html.encode('utf-8'))
+
+    def lookup(self, name: str) -> Tuple[Optional[Asset], str]:
+        """Файл по имени из URL и политика кэширования для ответа"""
+        asset = self.assets.get(name)
+        if asset is not None:
+            return asset, SHORT_CACHE_CONTROL
+
+        match = FINGERPRINT_RE.match(name)
+        if not match:
+            return None, ''
+        asset = self.assets.get(match.group(1) + match.group(3))
+        if asset is None:
+            return None, ''
+        if asset.digest.startswith(match.group(2)):
+            return asset, IMMUTABLE_CACHE_CONTROL
+        # Ссылка из устаревшей оболочки: отдаём актуальный файл без долгого кэша
+        return asset, 'no-cache'
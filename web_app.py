@@ -1,43 +1,329 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Request, render_template, request, jsonify, send_file, abort, g
+from flask.json.provider import DefaultJSONProvider
+from functools import wraps
+from urllib.parse import urlencode
+import hashlib
 import json
+import math
 import os
-from database import Database
+import time
+from database import Database, encode_cursor, search_terms, sort_order
+from cache import ResponseCache
+from media import MediaStore
+from compression import COMPRESSIBLE_MIMETYPES, compress, negotiate_encoding
+from static_assets import StaticAssets, IMMUTABLE_CACHE_CONTROL
+import metrics
 import config
 
-app = Flask(__name__, static_folder='.', static_url_path='')
+try:
+    import orjson
+except ImportError:  # без orjson используется стандартный json
+    orjson = None
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Сериализация ответов через orjson, если он установлен"""
+    
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # orjson сразу выдаёт байты UTF-8 - без промежуточной строки
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+class UploadRequest(Request):
+    """Запрос, который пишет загружаемые файлы сразу в хранилище фото"""
+    
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        upload = media_store.open_upload()
+        self.uploads = getattr(self, 'uploads', []) + [upload]
+        return upload
+
+# Статика раздаётся только из списка STATIC_FILES, каталог проекта наружу не открыт
+app = Flask(__name__, static_folder=None)
+app.request_class = UploadRequest
+app.json = FastJSONProvider(app)
+app.config['MAX_CONTENT_LENGTH'] = config.MAX_UPLOAD_MB * 1024 * 1024
 db = Database()
+response_cache = ResponseCache(maxsize=config.RESPONSE_CACHE_SIZE,
+                               ttl=config.RESPONSE_CACHE_TTL)
+media_store = MediaStore(config.MEDIA_ROOT, workers=config.MEDIA_WORKERS)
+metrics.registry.register_cache('responses', response_cache)
+
+# Оболочка Mini App: читается и сжимается один раз при запуске
+STATIC_FILES = ('index.html', 'script.js', 'styles.css')
+static_assets = StaticAssets(os.path.dirname(os.path.abspath(__file__)), STATIC_FILES)
+
+@app.before_request
+def start_request_metrics():
+    """Отметка начала запроса для метрик"""
+    g.started_at = time.perf_counter()
+    metrics.HTTP_IN_FLIGHT.inc()
+
+@app.after_request
+def record_status(response):
+    g.status_code = response.status_code
+    return response
+
+@app.after_request
+def compress_response(response):
+    return encode_response(response)
+
+def encode_response(response, variants=None):
+    """Сжатие текстового ответа по Accept-Encoding клиента
+    
+    variants - словарь уже сжатых тел по кодировкам (из кэша ответов).
+    """
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None or len(response.get_data()) < config.COMPRESS_MIN_SIZE:
+        return response
+    
+    body = variants.get(encoding) if variants is not None else None
+    if body is None:
+        body = compress(response.get_data(), encoding)
+        if variants is not None:
+            variants[encoding] = body
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое представление побайтно отличается: ETag становится слабым
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+@app.teardown_request
+def record_request_metrics(exc):
+    """Задержка и код ответа по шаблону маршрута (не по конкретному URL)"""
+    if 'started_at' not in g:
+        return
+    metrics.HTTP_IN_FLIGHT.dec()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_DURATION.observe(time.perf_counter() - g.started_at, request.method, route)
+    metrics.HTTP_REQUESTS.inc(request.method, route, str(g.get('status_code', 500)))
+
+@app.teardown_request
+def discard_uploads(exc):
+    """Удаление временных файлов загрузок, которые не попали в хранилище"""
+    for upload in getattr(request, 'uploads', []):
+        upload.discard()
+
+def add_thumbnails(ads, size_name='card'):
+    """Добавление URL превью первого фото для карточек ленты"""
+    for ad in ads:
+        photos = ad.get('photos') or []
+        ad['thumbnail'] = media_store.thumbnail_url(photos[0], size_name) if photos else None
+    return ads
+
+# Компактная карточка ленты: ровно то, что рисуют updateAdsUI() и избранное
+CARD_FIELDS = ('id', 'title', 'price', 'category', 'thumbnail', 'views', 'favorites_count')
+
+def requested_fields():
+    """Поля из ?fields=a,b или ?view=card; None - полное объявление"""
+    if request.args.get('view') == 'card':
+        return list(CARD_FIELDS)
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return [name.strip() for name in fields.split(',') if name.strip()]
+
+def query_fields(fields):
+    """Поля для выборки из базы: превью строится по photos"""
+    if fields is None:
+        return None
+    names = [name for name in fields if name != 'thumbnail']
+    if 'thumbnail' in fields and 'photos' not in names:
+        names.append('photos')
+    return names
+
+def shape_ads(ads, fields):
+    """Подготовка объявлений к ответу с учётом запрошенных полей"""
+    for ad in ads:
+        if 'created_at' in ad:
+            ad['created_at'] = str(ad['created_at'])
+    if fields is None or 'thumbnail' in fields:
+        add_thumbnails(ads)
+    if fields is not None and 'photos' not in fields:
+        for ad in ads:
+            ad.pop('photos', None)
+    return ads
+
+# Наибольшее число ID в одном пакетном запросе
+MAX_BATCH_IDS = 100
+# Наибольшая страница избранного
+MAX_FAVORITES_PAGE = 100
+# Наибольшая страница ленты
+MAX_FEED_PAGE = 100
+
+def feed_limit(default):
+    """Размер страницы ленты из ?limit=, приведённый к 1..MAX_FEED_PAGE"""
+    limit = request.args.get('limit', default, type=int)
+    return min(max(limit, 1), MAX_FEED_PAGE)
+
+def parse_ids(value):
+    """Список ID из '1,2,3' или JSON-массива; None - если он некорректен"""
+    if isinstance(value, str):
+        value = value.split(',') if value else []
+    if not isinstance(value, list) or not 0 < len(value) <= MAX_BATCH_IDS:
+        return None
+    try:
+        return [int(item) for item in value]
+    except (TypeError, ValueError):
+        return None
+
+def cached_response(*tags):
+    """Кэширование JSON-ответа по эндпоинту и параметрам запроса с ETag/304
+    
+    Теги могут ссылаться на параметры маршрута: 'stats:{telegram_id}'.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            key = request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+            entry = response_cache.get(key)
+            if entry is None:
+                generation = response_cache.generation
+                response = app.make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                # Сжатые варианты тела добавляются в запись при первом запросе
+                entry = (body, hashlib.sha1(body).hexdigest(), {})
+                response_cache.set(key, entry, [tag.format(**kwargs) for tag in tags],
+                                   generation=generation)
+            
+            body, etag, variants = entry
+            response = app.response_class(body, mimetype='application/json')
+            response.set_etag(etag)
+            # Клиент всегда перепроверяет ответ, повторная загрузка стоит 304 без тела
+            response.headers['Cache-Control'] = 'no-cache'
+            return encode_response(response.make_conditional(request), variants)
+        return wrapper
+    return decorator
 
 @app.route('/')
-def index():
-    return send_file('index.html')
+@app.route('/<name>')
+def static_file(name='index.html'):
+    """Файлы оболочки из памяти: готовое сжатие, ETag и кэширование по отпечатку"""
+    asset, cache_control = static_assets.lookup(name)
+    if asset is None:
+        abort(404)
+    
+    encoding = negotiate_encoding(request.accept_encodings)
+    body, etag = asset.representation(encoding)
+    response = app.response_class(body, mimetype=asset.mimetype)
+    if body is not asset.body:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
 
 @app.route('/api/ads')
+@cached_response('ads')
 def get_ads():
     """API для получения объявлений"""
     category = request.args.get('category')
     user_id = request.args.get('user_id', type=int)
     search = request.args.get('search')
-    limit = request.args.get('limit', 50, type=int)
+    limit = feed_limit(50)
     offset = request.args.get('offset', 0, type=int)
+    cursor = request.args.get('cursor')
+    # ?price_min=&price_max=&location=&sort=price_asc - фильтры и порядок ленты
+    price_min = request.args.get('price_min', type=float)
+    price_max = request.args.get('price_max', type=float)
+    location = request.args.get('location') or None
+    sort = request.args.get('sort') or None
+    # ?view=card или ?fields=id,title,... - только нужные поля
+    fields = requested_fields()
     
-    ads = db.get_ads(category=category, user_id=user_id, 
-                    limit=limit, offset=offset, search_query=search)
+    try:
+        sort_key, _ = sort_order(sort)
+        ads = db.get_ads(category=category, user_id=user_id, 
+                        limit=limit, offset=offset, search_query=search,
+                        cursor=cursor, fields=query_fields(fields),
+                        price_min=price_min, price_max=price_max,
+                        location=location, sort=sort)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    shape_ads(ads, fields)
     
-    # Преобразуем datetime в строку для JSON
-    for ad in ads:
-        if 'created_at' in ad:
-            ad['created_at'] = str(ad['created_at'])
+    # Курсорная пагинация: ?cursor= (пустой для первой страницы)
+    # возвращает страницу вместе с курсором следующей
+    if cursor is not None:
+        next_cursor = None
+        if ads and len(ads) == limit and not search:
+            next_cursor = encode_cursor(ads[-1], sort_key)
+        return jsonify({'ads': ads, 'next_cursor': next_cursor})
     
     return jsonify(ads)
 
+@app.route('/api/bootstrap')
+def bootstrap():
+    """Всё для первого экрана Mini App одним запросом из одного снимка базы"""
+    telegram_id = request.args.get('user_id', type=int)
+    limit = feed_limit(10)
+    
+    user, favorite_ids, stats = None, [], None
+    with db.read_snapshot():
+        if telegram_id:
+            user = db.get_user_by_telegram_id(telegram_id)
+        ads = db.get_ads(limit=limit, fields=query_fields(CARD_FIELDS))
+        if user:
+            favorite_ids = db.get_user_favorite_ids(user['id'])
+            stats = db.get_user_stats(user['id'])
+    
+    shape_ads(ads, CARD_FIELDS)
+    if user:
+        # Убираем приватные данные
+        user.pop('phone', None)
+    return jsonify({
+        'user': user,
+        'categories': config.CATEGORIES,
+        'ads': ads,
+        'next_cursor': encode_cursor(ads[-1]) if ads and len(ads) == limit else None,
+        'favorite_ids': favorite_ids,
+        'stats': stats
+    })
+
 @app.route('/api/ad/<int:ad_id>')
 def get_ad(ad_id):
     """API для получения конкретного объявления"""
     ad = db.get_ad_by_id(ad_id)
     if ad and 'created_at' in ad:
         ad['created_at'] = str(ad['created_at'])
+    if ad:
+        ad['photos_detail'] = [media_store.thumbnail_url(url, 'detail') for url in ad['photos']]
     return jsonify(ad if ad else {})
 
+@app.route('/api/ads_by_ids')
+@cached_response('ads')
+def get_ads_by_ids():
+    """API для получения нескольких объявлений одним запросом: ?ids=1,2,3"""
+    ad_ids = parse_ids(request.args.get('ids', ''))
+    if ad_ids is None:
+        return jsonify({'error': f'ids must be 1-{MAX_BATCH_IDS} integers'}), 400
+    
+    fields = requested_fields()
+    try:
+        ads = db.get_ads_by_ids(ad_ids, fields=query_fields(fields))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(shape_ads(ads, fields))
+
 @app.route('/api/create_ad', methods=['POST'])
 def create_ad():
     """API для создания объявления"""
@@ -64,6 +350,7 @@ def create_ad():
         location=data.get('location', ''),
         contact_preference=data.get('contact_preference', 'telegram')
     )
+    response_cache.invalidate('ads', f"stats:{data['user_id']}")
     
     return jsonify({'success': True, 'ad_id': ad_id})
 
@@ -80,29 +367,85 @@ def get_user(telegram_id):
 def toggle_favorite():
     """API для добавления/удаления из избранного"""
     data = request.json
+    # Как parse_ids: состояния в базе ключуются целыми ID, строка '5' их бы не нашла
+    try:
+        ad_id = int(data['ad_id'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'ad_id must be an integer'}), 400
     
     user = db.get_user_by_telegram_id(data['user_id'])
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    is_favorite = db.toggle_favorite(user['id'], data['ad_id'])
+    is_favorite = db.toggle_favorite(user['id'], ad_id)
+    # Меняется счётчик в ленте, избранное пользователя и статистика продавца
+    response_cache.invalidate('ads', f"favorites:{data['user_id']}",
+                              f"stats:{db.get_ad_seller(ad_id)}")
     return jsonify({'success': True, 'is_favorite': is_favorite})
 
+@app.route('/api/toggle_favorites', methods=['POST'])
+def toggle_favorites():
+    """API для переключения избранного у нескольких объявлений одной транзакцией"""
+    data = request.json
+    ad_ids = parse_ids(data.get('ad_ids'))
+    if ad_ids is None:
+        return jsonify({'error': f'ad_ids must be 1-{MAX_BATCH_IDS} integers'}), 400
+    
+    user = db.get_user_by_telegram_id(data['user_id'])
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    states = db.toggle_favorites(user['id'], ad_ids)
+    response_cache.invalidate('ads', f"favorites:{data['user_id']}",
+                              *[f'stats:{seller}' for seller in db.get_ad_sellers(ad_ids)])
+    return jsonify({'success': True, 'favorites': states})
+
+@app.route('/api/favorite_states/<int:telegram_id>')
+@cached_response('favorites', 'favorites:{telegram_id}')
+def get_favorite_states(telegram_id):
+    """API для проверки, какие из объявлений в избранном: ?ids=1,2,3"""
+    ad_ids = parse_ids(request.args.get('ids', ''))
+    if ad_ids is None:
+        return jsonify({'error': f'ids must be 1-{MAX_BATCH_IDS} integers'}), 400
+    
+    user = db.get_user_by_telegram_id(telegram_id)
+    if not user:
+        return jsonify({ad_id: False for ad_id in ad_ids})
+    
+    return jsonify(db.get_favorite_states(user['id'], ad_ids))
+
 @app.route('/api/user_favorites/<int:telegram_id>')
+@cached_response('favorites', 'favorites:{telegram_id}')
 def get_user_favorites(telegram_id):
     """API для получения избранного пользователя"""
     user = db.get_user_by_telegram_id(telegram_id)
     if not user:
         return jsonify([])
     
-    favorites = db.get_user_favorites(user['id'])
-    for fav in favorites:
-        if 'created_at' in fav:
-            fav['created_at'] = str(fav['created_at'])
+    cursor = request.args.get('cursor')
+    # Страницы ограничены только при ?cursor=, без него - всё избранное, как раньше
+    limit = request.args.get('limit', type=int)
+    if cursor is not None:
+        limit = min(limit or MAX_FAVORITES_PAGE, MAX_FAVORITES_PAGE)
+    fields = requested_fields()
+    try:
+        favorites = db.get_user_favorites(user['id'], fields=query_fields(fields),
+                                          limit=limit, cursor=cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    shape_ads(favorites, fields)
+    
+    # Как в /api/ads: с ?cursor= ответ содержит курсор следующей страницы
+    if cursor is not None:
+        next_cursor = None
+        if len(favorites) == limit:
+            next_cursor = encode_cursor(favorites[-1], 'favorited_at')
+        return jsonify({'ads': favorites, 'next_cursor': next_cursor})
     
     return jsonify(favorites)
 
 @app.route('/api/categories')
+@cached_response('categories')
 def get_categories():
     """API для получения категорий"""
     return jsonify(config.CATEGORIES)
@@ -117,9 +460,13 @@ def delete_ad():
         return jsonify({'error': 'User not found'}), 404
     
     success = db.delete_ad(user['id'], data['ad_id'])
+    if success:
+        # Объявление пропадает из ленты и из избранного у всех пользователей
+        response_cache.invalidate('ads', 'favorites', f"stats:{data['user_id']}")
     return jsonify({'success': success})
 
 @app.route('/api/stats/<int:telegram_id>')
+@cached_response('stats:{telegram_id}')
 def get_stats(telegram_id):
     """API для получения статистики пользователя"""
     user = db.get_user_by_telegram_id(telegram_id)
@@ -129,16 +476,94 @@ def get_stats(telegram_id):
     stats = db.get_user_stats(user['id'])
     return jsonify(stats)
 
+@app.route('/api/saved_searches/<int:telegram_id>')
+def get_saved_searches(telegram_id):
+    """API для получения сохранённых поисков пользователя"""
+    user = db.get_user_by_telegram_id(telegram_id)
+    if not user:
+        return jsonify([])
+    return jsonify(db.get_saved_searches(user['id']))
+
+@app.route('/api/save_search', methods=['POST'])
+def save_search():
+    """API для сохранения поиска: уведомления о новых подходящих объявлениях"""
+    data = request.json
+    query = (data.get('query') or '').strip() or None
+    category = data.get('category') or None
+    if not search_terms(query) and not category:
+        return jsonify({'error': 'Missing query or category'}), 400
+    try:
+        price_min, price_max = [float(data[key]) if data.get(key) is not None else None
+                                for key in ('price_min', 'price_max')]
+    except (TypeError, ValueError):
+        price_min = price_max = math.nan
+    if not all(math.isfinite(price) for price in (price_min, price_max) if price is not None):
+        return jsonify({'error': 'price_min and price_max must be numbers'}), 400
+    # Такой поиск никогда не сработает, но занял бы место в MAX_SAVED_SEARCHES
+    if price_min is not None and price_max is not None and price_min > price_max:
+        return jsonify({'error': 'price_min is greater than price_max'}), 400
+
+    user = db.get_user_by_telegram_id(data['user_id'])
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    if len(db.get_saved_searches(user['id'])) >= config.MAX_SAVED_SEARCHES:
+        return jsonify({'error': f'Limit of {config.MAX_SAVED_SEARCHES} saved searches'}), 400
+
+    search_id = db.create_saved_search(user['id'], query=query, category=category,
+                                       price_min=price_min, price_max=price_max)
+    return jsonify({'success': True, 'search_id': search_id})
+
+@app.route('/api/delete_saved_search', methods=['POST'])
+def delete_saved_search():
+    """API для удаления сохранённого поиска"""
+    data = request.json
+
+    user = db.get_user_by_telegram_id(data['user_id'])
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    return jsonify({'success': db.delete_saved_search(user['id'], data['search_id'])})
+
 @app.route('/upload_photo', methods=['POST'])
 def upload_photo():
-    """Эндпоинт для загрузки фото (заглушка - в реальности нужно настроить хостинг файлов)"""
-    # В реальном приложении здесь будет код для сохранения файлов
-    # Для демо возвращаем заглушку
+    """Загрузка фото: файл пишется на диск потоком и сохраняется по хэшу содержимого"""
+    photo = request.files.get('photo')
+    if photo is None:
+        return jsonify({'error': 'Missing photo'}), 400
+    
+    try:
+        url = media_store.save(photo.stream)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     return jsonify({
         'success': True,
-        'url': 'https://via.placeholder.com/400x300/7B1FA2/FFFFFF?text=Vape+Photo'
+        'url': url,
+        'thumbnail': media_store.thumbnail_url(url, 'card')
     })
 
+@app.route('/media/<name>')
+def get_media(name):
+    """Отдача фото и превью с долгим кэшированием"""
+    path = media_store.path_for(name)
+    if path and os.path.exists(path):
+        response = send_file(path, conditional=True)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+    
+    # Превью ещё не готово: временно отдаём оригинал без долгого кэша
+    original = media_store.original_path(name)
+    if not original:
+        abort(404)
+    response = send_file(original, conditional=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    """Метрики бота, API и базы в текстовом формате Prometheus"""
+    return app.response_class(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 def run_web_server():
     """Запуск веб-сервера"""
     app.run(host=config.WEB_SERVER_HOST, 